@@ -1,8 +1,24 @@
-from flask import Flask, Blueprint, request, jsonify, send_file, redirect, render_template
+from flask import Flask, Blueprint, Response, request, jsonify, make_response, send_file, send_from_directory, redirect, render_template, stream_with_context
 from flask_cors import CORS
-from dotenv import load_dotenv
+from werkzeug.utils import secure_filename
+from response_cache import ResponseCache
+from compression import Compression
+import call_log
+import db_pool
+import metrics
+import profiling
+import security
+import security_rollups
+import settings
 from datetime import datetime
 import os, sys
+import csv
+import hashlib
+import io
+import ipaddress
+import json
+import math
+import zlib
 import logging
 import sys
 
@@ -14,7 +30,18 @@ logging.basicConfig(
 )
 
 app = Flask(__name__)
+settings.install_reload_handler()
 CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000", "https://korysanchez.me"])
+# Before finance/lego_db are imported, so their pooled connections are timed;
+# registered ahead of compression so request latency includes it
+metrics.install_sql_timing()
+metrics.init_app(app)
+profiling.init_app(app)
+compression = Compression(
+    app,
+    min_bytes=settings.current.compression_min_bytes,
+    cache_bytes=settings.current.compression_cache_bytes
+)
 
 
 @app.route('/')
@@ -49,16 +76,79 @@ try:
 except ImportError:
     finance = None
     print("Error: finance module not found. Ensure it is installed and accessible.")
+import statements
+
+@app.errorhandler(TimeoutError)
+def timed_out(e):
+    """Timeouts such as a finance write still queued after WRITE_TIMEOUT; the client should retry."""
+    app.logger.error(f"Timed out: {e!r}")
+    response = jsonify({"error": "Database busy, try again"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+REQUIRED_TRANSACTION_FIELDS = ["User", "Category", "Amount", "Date", "Title"]
+
+def parse_transaction(data):
+    """
+    Validate an incoming transaction payload.
+
+    :return: (insert_transaction kwargs, None) or (None, error dict)
+    """
+    if not isinstance(data, dict):
+        return None, {"error": "Transaction must be a JSON object"}
+
+    missing_fields = [field for field in REQUIRED_TRANSACTION_FIELDS if field not in data]
+    if missing_fields:
+        return None, {"error": "Missing required fields", "missing": missing_fields}
+
+    # User, Category and Title are NOT NULL text columns; a null or an object
+    # would otherwise fail the whole batch's executemany
+    invalid_fields = [field for field in ("User", "Category", "Title") if not _is_scalar(data[field])]
+    invalid_fields += [field for field in ("Description", "Rate")
+                       if data.get(field) is not None and not _is_scalar(data[field])]
+    if invalid_fields:
+        return None, {"error": "Fields must be strings or numbers", "invalid": invalid_fields}
+
+    amount = _parse_number(data["Amount"])
+    if amount is None:
+        return None, {"error": f"Invalid amount: {data['Amount']!r}"}
+
+    # Convert the incoming date string to a datetime object
+    try:
+        # Example format: "Nov 6, 2025 at 6:28 PM"
+        date_obj = datetime.strptime(data["Date"], "%b %d, %Y at %I:%M %p")
+    except (TypeError, ValueError) as e:
+        return None, {"error": f"Invalid date format: {e}"}
+
+    return {
+        "user": str(data["User"]),
+        "category": str(data["Category"]),
+        "amount": amount,
+        "date_obj": date_obj,
+        "title": str(data["Title"]),
+        "description": data.get("Description", ""),
+        "rate": data.get("Rate", None)
+    }, None
+
+def _is_scalar(value) -> bool:
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+def _parse_number(value) -> float | None:
+    """A finite float from a JSON number or numeric string, else None."""
+    if not _is_scalar(value):
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
 
 @app.route('/finance/api', methods=['POST'])
 def receive_data():
-    load_dotenv()
-    EXPECTED_PW = os.environ.get("FINANCE_API_PW")
-
     logger = app.logger
     logger.info(f"Received request: {request.method} {request.path}")
     # Check custom header
-    if request.headers.get("pw") != EXPECTED_PW:
+    if not settings.check_finance_password(request.headers.get("pw")):
         return jsonify({"error": "Unauthorized"}), 401
 
     # Check JSON body
@@ -66,32 +156,12 @@ def receive_data():
         return jsonify({"error": "Request must be JSON"}), 400
 
     data = request.get_json()
-    required_fields = ["User", "Category", "Amount", "Date", "Title"]
-
-
-    
-    missing_fields = [field for field in required_fields if field not in data]
-    if missing_fields:
-        return jsonify({"error": "Missing required fields", "missing": missing_fields}), 400
-
-    # Convert the incoming date string to a datetime object
-    try:
-        # Example format: "Nov 6, 2025 at 6:28 PM"
-        date_obj = datetime.strptime(data["Date"], "%b %d, %Y at %I:%M %p")
-    except ValueError as e:
-        return jsonify({"error": f"Invalid date format: {e}"}), 400
+    transaction, error = parse_transaction(data)
+    if error:
+        return jsonify(error), 400
 
     # Insert into database
-    success = finance.insert_transaction(
-        user=data["User"],
-        category=data["Category"],
-        amount=data["Amount"],
-        date_obj=date_obj,
-        title=data["Title"],
-        description=data.get("Description", ""),
-        rate=data.get("Rate", None),
-        logger=logger
-    )
+    success = finance.insert_transaction(**transaction, logger=logger)
 
     if success:
         app.logger.info(f"Inserted transaction: {data}")
@@ -102,24 +172,292 @@ def receive_data():
 
 
 
+@app.route('/finance/api/batch', methods=['POST'])
+def receive_batch():
+    """Insert many transactions in one database transaction; body is a JSON array or NDJSON."""
+    logger = app.logger
+    logger.info(f"Received batch request: {request.method} {request.path}")
+    if not settings.check_finance_password(request.headers.get("pw")):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    errors = []
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line_no, line in enumerate(request.get_data(as_text=True).splitlines()):
+            if not line.strip():
+                continue
+            try:
+                items.append((line_no, json.loads(line)))
+            except ValueError as e:
+                errors.append({"index": line_no, "error": f"Invalid JSON: {e}"})
+    elif request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get("transactions")
+        if not isinstance(data, list):
+            return jsonify({"error": "Body must be a JSON array of transactions"}), 400
+        items = list(enumerate(data))
+    else:
+        return jsonify({"error": "Request must be JSON or NDJSON"}), 400
+
+    transactions = []
+    for index, item in items:
+        transaction, error = parse_transaction(item)
+        if error:
+            errors.append({"index": index, **error})
+        else:
+            transactions.append(transaction)
+
+    if not transactions:
+        return jsonify({"inserted": 0, "errors": errors}), 400
+
+    inserted = finance.insert_transactions(transactions, logger=logger)
+    if inserted is None:
+        return jsonify({"error": "Failed to insert transactions", "errors": errors}), 500
+
+    logger.info(f"Inserted {inserted} transactions, rejected {len(errors)}")
+    return jsonify({"inserted": inserted, "errors": errors}), 200
+
+# Bumped when the JSON shape of transaction rows changes
+ROW_SHAPE = 2
+
 @app.route('/finance/api/transactions', methods=['GET'])
 def get_transactions():
     user = request.args.get('user')
     if not user:
         return jsonify({"error": "Missing 'user' query parameter"}), 400
 
-    transactions = finance.get_transactions_by_user(user)
-    return jsonify(transactions)
-    
+    # Strong ETag from the user's change counter plus the query args, so an
+    # unchanged history is answered with 304 before any transaction row is read.
+    # ROW_SHAPE keeps validators cached for the old array-of-arrays rows from matching
+    version = finance.get_user_version(user)
+    etag = None
+    if version >= 0:
+        variant = hashlib.sha1(repr((ROW_SHAPE, sorted(request.args.items(multi=True)))).encode()).hexdigest()[:12]
+        etag = f"{version}-{variant}"
+        # Weak comparison: the compressed representation carries W/"<etag>"
+        if request.if_none_match.contains_weak(etag):
+            call_log.log_call("transactions_from_cache", user_id=user)
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+    response = transactions_response(user)
+    if response.status_code == 200:
+        call_log.log_call("transactions_from_db", user_id=user, format=request.args.get('format', 'json'))
+        if etag:
+            response.set_etag(etag)
+    return response
+
+def parse_page_args(limit, cursor):
+    """
+    Validate keyset pagination arguments from a query string or JSON body.
+
+    :return: (limit as int, cursor or None)
+    :raises ValueError: with a message fit to return to the client
+    """
+    if limit is None:
+        limit = finance.PAGE_SIZE
+    elif isinstance(limit, bool) or not isinstance(limit, (int, str)):
+        raise ValueError("limit must be an integer")
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("limit must be an integer") from None
+    if cursor is not None and not isinstance(cursor, str):
+        raise ValueError("cursor must be a string")
+    return limit, cursor or None
+
+def transactions_response(user):
+    # NDJSON streaming: one transaction per line, straight from a fetchmany cursor
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for row in finance.iter_transactions_by_user(user):
+                yield json.dumps(finance.transaction_to_dict(row)) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    # Keyset pagination, newest first
+    if 'limit' in request.args or 'cursor' in request.args:
+        try:
+            limit, cursor = parse_page_args(request.args.get('limit'), request.args.get('cursor'))
+            rows, next_cursor = finance.get_transactions_page(user, limit=limit, cursor=cursor)
+        except ValueError as e:
+            return make_response(jsonify({"error": str(e)}), 400)
+        return jsonify({
+            "transactions": [finance.transaction_to_dict(row) for row in rows],
+            "next_cursor": next_cursor
+        })
+
+    # Same row shape as the paged, NDJSON and login responses
+    return jsonify([finance.transaction_to_dict(row) for row in finance.get_transactions_by_user(user)])
+
+
 
+@app.route('/finance/api/summary', methods=['GET'])
+def get_summary():
+    """Per-month, per-category totals for a user, optionally bounded by from/to (YYYY-MM)"""
+    user = request.args.get('user')
+    if not user:
+        return jsonify({"error": "Missing 'user' query parameter"}), 400
+
+    start_month = request.args.get('from')
+    end_month = request.args.get('to')
+    for month in (start_month, end_month):
+        if month:
+            try:
+                datetime.strptime(month, "%Y-%m")
+            except ValueError:
+                return jsonify({"error": "from/to must be formatted YYYY-MM"}), 400
 
+    return jsonify(finance.get_summary(user, start_month, end_month))
+
+
+
+@app.route('/finance/api/import', methods=['POST'])
+def import_statement():
+    """
+    Import a bank statement CSV for ?user=, sent as the raw text/csv body or
+    as a multipart 'file'. Optional: mapping (JSON {field: column}),
+    date_format (strptime) and category (for rows without one).
+    Rows already imported are skipped, so overlapping statements can be re-sent.
+    """
+    logger = app.logger
+    if not settings.check_finance_password(request.headers.get("pw")):
+        return jsonify({"error": "Unauthorized"}), 401
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if upload is None:
+            return jsonify({"error": "Missing 'file' upload"}), 400
+        stream = upload.stream
+    elif request.mimetype in ("text/csv", "text/plain", "application/octet-stream"):
+        stream = request.stream
+    else:
+        return jsonify({"error": "Send the statement as text/csv or a multipart 'file'"}), 400
+
+    user = request.values.get('user')
+    if not user:
+        return jsonify({"error": "Missing 'user' parameter"}), 400
+    try:
+        mapping = json.loads(request.values.get('mapping', '{}'))
+        if not isinstance(mapping, dict):
+            raise ValueError("mapping must be a JSON object")
+        result = statements.import_stream(
+            user, stream, mapping=mapping,
+            date_format=request.values.get('date_format'),
+            default_category=request.values.get('category') or statements.DEFAULT_CATEGORY,
+            logger=logger
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        logger.error(str(e))
+        return jsonify({"error": str(e)}), 500
+    logger.info(f"Imported statement for {user}: {result['inserted']} inserted, "
+                f"{result['duplicates']} duplicates, {result['rejected']} rejected")
+    return jsonify(result), 200
+
+
+EXPORT_COLUMNS = ["date", "category", "amount", "title", "description", "rate", "id"]
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+@app.route('/finance/api/export', methods=['GET'])
+def export_transactions():
+    """
+    A user's transactions as CSV, newest first, optionally bounded by from/to
+    (YYYY-MM-DD, inclusive) and limited to one or more ?category= values.
+    ?gzip=1 sends a .csv.gz. Rows are streamed from a fetchmany cursor one
+    batch at a time, so memory stays flat however long the history is.
+    """
+    if not settings.check_finance_password(request.headers.get("pw")):
+        return jsonify({"error": "Unauthorized"}), 401
+    user = request.args.get('user')
+    if not user:
+        return jsonify({"error": "Missing 'user' query parameter"}), 400
+
+    start = request.args.get('from')
+    end = request.args.get('to')
+    for day in (start, end):
+        if day:
+            try:
+                datetime.strptime(day, "%Y-%m-%d")
+            except ValueError:
+                return jsonify({"error": "from/to must be formatted YYYY-MM-DD"}), 400
+    categories = request.args.getlist('category')
+    compress = request.args.get('gzip') == '1'
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def take():
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return data
+
+        # The header goes out before the query runs
+        writer.writerow(EXPORT_COLUMNS)
+        yield take()
+        for row in finance.iter_transactions_by_user(user, start=start, end=end, categories=categories):
+            tx = finance.transaction_to_dict(row)
+            writer.writerow([tx[column] for column in EXPORT_COLUMNS])
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield take()
+        yield take()
+
+    def gzipped(chunks):
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            # Sync flush so every chunk reaches the client as it is produced
+            yield gz.compress(chunk.encode()) + gz.flush(zlib.Z_SYNC_FLUSH)
+        yield gz.flush()
+
+    name = f"transactions-{secure_filename(user) or 'export'}.csv"
+    if compress:
+        response = Response(stream_with_context(gzipped(generate())), mimetype="application/gzip")
+        name += ".gz"
+    else:
+        response = Response(stream_with_context(generate()), mimetype="text/csv")
+    response.headers["Content-Disposition"] = f'attachment; filename="{name}"'
+    return response
+
+
+
+@app.route('/security/stats', methods=['GET'])
+def security_stats():
+    """
+    Failed logins over the last ?hours= (default 24) and the ?top= offending IPs and usernames, from hourly rollups.
+    Needs the METRICS_TOKEN bearer; with no token configured the endpoint stays closed,
+    since the usernames under attack are half of a finance login.
+    """
+    if not settings.check_metrics_token(request.headers.get("Authorization")):
+        return jsonify({"error": "Unauthorized"}), 401
+    hours = request.args.get('hours', 24, type=int)
+    top = request.args.get('top', 10, type=int)
+    if not 1 <= hours <= 24 * 366 or not 1 <= top <= 1000:
+        return jsonify({"error": "hours must be 1-8784 and top 1-1000"}), 400
+    with security.get_pool().read() as conn:
+        return jsonify(security_rollups.window_stats(conn, hours, top))
+
+def client_ip():
+    """
+    Caller's address. nginx passes the original one in X-Real-IP, but anyone
+    can send that header, so it is only believed from TRUSTED_PROXIES.
+    """
+    remote = request.remote_addr
+    forwarded = request.headers.get("X-Real-IP", "").strip()
+    if not remote or not forwarded:
+        return remote
+    try:
+        if not any(ipaddress.ip_address(remote) in network for network in settings.current.trusted_proxies):
+            return remote
+        return str(ipaddress.ip_address(forwarded))
+    except ValueError:
+        return remote
 
 @app.route('/finance/login', methods=['POST'])
 def finance_login():
     """Handle user login and return their transactions"""
-    load_dotenv()
-    EXPECTED_PW = os.environ.get("FINANCE_API_PW")
-    
     logger = app.logger
     logger.info(f"Received login request: {request.method} {request.path}")
     
@@ -134,36 +472,43 @@ def finance_login():
     # Validate credentials
     if not username or not password:
         return jsonify({"error": "Username and password required"}), 400
-    
-    # Check password against environment variable
-    if password != EXPECTED_PW:
+
+    # Bans, locks and rate limits are answered from memory, before any database work
+    guard = security.get_guard()
+    ip = client_ip()
+    rejected = guard.check(username, ip)
+    if rejected == "rate_limited":
+        return jsonify({"error": "Too many login attempts, try again later"}), 429
+    if rejected:
+        return jsonify({"error": "Account locked" if rejected == "locked" else "Access denied"}), 403
+
+    # Check password against the cached FINANCE_API_PW
+    if not settings.check_finance_password(password):
+        guard.record_failure(username, ip)
         return jsonify({"error": "Invalid credentials"}), 401
+    guard.record_success(username)
     
     # Fetch user's transactions from database
     try:
-        rows = finance.get_transactions_by_user(username)  # Ensure the function is working
-        logger.info(rows)
-        # Convert to list of dictionaries
-        transactions = []
-        for row in rows:
-            transactions.append({
-                "category": row[0],
-                "amount": row[1],
-                "date": row[2],
-                "title": row[3],
-                "description": row[4],
-                "rate": row[5],
-                "id": row[6]
-            })
-        
-        
+        next_cursor = None
+        if "limit" in data or "cursor" in data:
+            limit, cursor = parse_page_args(data.get("limit"), data.get("cursor"))
+            rows, next_cursor = finance.get_transactions_page(username, limit=limit, cursor=cursor)
+        else:
+            rows = finance.get_transactions_by_user(username)
+        transactions = [finance.transaction_to_dict(row) for row in rows]
+
         logger.info(f"Login successful for user: {username}, found {len(transactions)} transactions")
+        call_log.log_call("transactions_from_db", user_id=username, count=len(transactions))
         return jsonify({
             "success": True,
             "username": username,
-            "transactions": transactions
+            "transactions": transactions,
+            "next_cursor": next_cursor
         }), 200
-        
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Database error: {e}")
         return jsonify({"error": "Database error occurred"}), 500
@@ -235,36 +580,74 @@ except ImportError:
 
 lego_bp = Blueprint('lego', __name__)
 
+# The inventory rarely changes, so catalog reads are served from memory until
+# PRAGMA data_version reports a commit to lego_db.db
+lego_cache = ResponseCache(
+    lambda: lego_db.get_pool().data_version(),
+    max_entries=settings.current.lego_cache_entries,
+    max_bytes=settings.current.lego_cache_bytes
+)
+
+import part_images
+
+# Variants keep their URL when the source image is replaced, so they are
+# cached for a week and revalidated by ETag rather than marked immutable
+PART_IMAGE_MAX_AGE = 7 * 24 * 3600
+
 @app.route('/part_images/<path:filename>')
 def serve_part_images(filename):
-    # Path to your images in the container
-    return send_from_directory('/app/public/part_images', filename)
+    """Original part image, or a cached variant with ?w=<width> and/or ?format=webp|png|jpeg"""
+    width = request.args.get('w', type=int)
+    fmt = request.args.get('format')
+    if (width is None and fmt is None) or part_images.Image is None:
+        return send_from_directory(settings.current.part_images_dir, filename, max_age=PART_IMAGE_MAX_AGE)
+
+    negotiated = fmt is None
+    if negotiated:
+        fmt = "webp" if request.accept_mimetypes["image/webp"] else part_images.default_format(filename)
+    if fmt not in part_images.FORMATS or (width is not None and width <= 0):
+        return jsonify({"error": "Invalid width or format"}), 400
+
+    try:
+        path = part_images.get_variant(filename, width, fmt)
+    except OSError as e:
+        app.logger.error(f"Could not build variant of {filename}: {e}")
+        return jsonify({"error": "Could not process image"}), 500
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+
+    # The variant's file name is a digest of source, size and format; unlike
+    # send_file's default tag it doesn't change when a cache hit touches mtime
+    etag = os.path.splitext(os.path.basename(path))[0]
+    response = send_file(path, mimetype=part_images.FORMATS[fmt], conditional=True, etag=etag, max_age=PART_IMAGE_MAX_AGE)
+    if negotiated:
+        response.vary.add("Accept")
+    return response
 
 
 @lego_bp.route('/boxes')
+@lego_cache.cached
 def get_boxes():
     """Get all box IDs"""
     if not lego_db:
         return jsonify({"error": "lego_db module is not available"}), 500
 
     try:
-        print("connecting")
-        conn = lego_db.connect_db()
-        print("connected")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM Box ORDER BY id")
-        boxes = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        with lego_db.get_pool().read() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM Box ORDER BY id")
+            boxes = [row[0] for row in cursor.fetchall()]
         return jsonify(boxes)
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
 @lego_bp.route('/box/<box_id>')
+@lego_cache.cached
 def get_box_contents(box_id):
     """Get contents of a specific box"""
-    conn = lego_db.connect_db()
-    box_contents = lego_db.get_contents_of_box(conn, box_id)
+    with lego_db.get_pool().read() as conn:
+        box_contents = lego_db.get_contents_of_box(conn, box_id)
     
     # Format the results
     results = []
@@ -277,23 +660,28 @@ def get_box_contents(box_id):
             "name": name,
             "category": category
         })
-    
-    conn.close()
+
     return jsonify(results)
 
+@lego_bp.route('/inventory')
+@lego_cache.cached
+def get_inventory():
+    """Whole storage layout in one columnar payload (see lego_db.get_inventory)"""
+    with lego_db.get_pool().read() as conn:
+        inventory = lego_db.get_inventory(conn)
+    return app.response_class(json.dumps(inventory, separators=(",", ":")), mimetype="application/json")
+
 @lego_bp.route('/container/<container_id>')
+@lego_cache.cached
 def get_container(container_id):
     """Get details of a specific container"""
-    conn = lego_db.connect_db()
     try:
-        container = lego_db.get_container_from_id(conn, container_id)
+        with lego_db.get_pool().read() as conn:
+            container = lego_db.get_container_from_id(conn, container_id)
         if not container:
-            conn.close()
             return jsonify({"error": "Container not found"}), 404
-        conn.close()
         return jsonify(container)
     except ValueError as e:
-        conn.close()
         return jsonify({"error": str(e)}), 400
 
 @lego_bp.route('/piece/search')
@@ -305,46 +693,88 @@ def search_piece():
     if not search_term:
         return jsonify([])
     
-    conn = lego_db.connect_db()
-    
+    if search_type not in ('part_number', 'name', 'category'):
+        return jsonify({"error": "Invalid search type"}), 400
+
     try:
-        if search_type == 'part_number':
-            results = lego_db.search_piece(conn, part_number=search_term)
-        elif search_type == 'name':
-            results = lego_db.search_piece(conn, name=search_term)
-        elif search_type == 'category':
-            results = lego_db.search_piece(conn, category=search_term)
-        else:
-            conn.close()
-            return jsonify({"error": "Invalid search type"}), 400
-        
-        conn.close()
+        limit = request.args.get('limit')
+        limit = int(limit) if limit is not None else None
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+
+    try:
+        with lego_db.get_pool().read() as conn:
+            results = lego_db.search_piece(conn, **{search_type: search_term}, limit=limit, offset=offset)
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@lego_bp.route('/piece/lookup', methods=['POST'])
+def lookup_pieces():
+    """Locate every part of a build list; body is {"part_numbers": [...]} or a plain array"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("part_numbers")
+    if not isinstance(data, list) or not all(isinstance(pn, (str, int)) for pn in data):
+        return jsonify({"error": "Body must be a list of part numbers"}), 400
+    if len(data) > lego_db.MAX_LOOKUP_PARTS:
+        return jsonify({"error": f"At most {lego_db.MAX_LOOKUP_PARTS} part numbers per request"}), 400
+
+    try:
+        with lego_db.get_pool().read() as conn:
+            results = lego_db.locate_pieces(conn, data)
         return jsonify(results)
     except Exception as e:
-        conn.close()
         return jsonify({"error": str(e)}), 500
 
 @lego_bp.route('/positions')
+@lego_cache.cached
 def get_positions():
     """Get all available positions"""
-    conn = lego_db.connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM Position ORDER BY id")
-    positions = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    with lego_db.get_pool().read() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM Position ORDER BY id")
+        positions = [row[0] for row in cursor.fetchall()]
     return jsonify(positions)
 
 @lego_bp.route('/categories')
+@lego_cache.cached
 def get_categories():
     """Retrieve all distinct piece categories from the catalog"""
-    conn = lego_db.connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT category FROM Piece")
-    categories = [row[0] for row in cur.fetchall()]
-    conn.close()
+    with lego_db.get_pool().read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT category FROM Piece")
+        categories = [row[0] for row in cur.fetchall()]
     return jsonify(categories)
 
+@lego_bp.route('/cache/stats')
+def get_cache_stats():
+    """Hit-rate statistics for the catalog response cache in this worker"""
+    return jsonify(lego_cache.stats())
+
 app.register_blueprint(lego_bp, url_prefix='/lego/api')
 
+
+def collect_gauges():
+    """Pool, cache, compression, login guard and write queue counters for /metrics"""
+    for pool in db_pool.stats():
+        labels = {"db": os.path.basename(pool["db"])}
+        for key in ("open", "idle", "hits", "misses", "waits"):
+            yield f"db_pool_{key}", f"Connection pool {key}", labels, pool[key]
+    for key, value in lego_cache.stats().items():
+        yield f"lego_cache_{key}", f"Lego response cache {key}", {}, value
+    for key, value in compression.stats().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"compression_{key}", f"Response compression {key}", {}, value
+    for key, value in security.get_guard().stats().items():
+        if value is not None:
+            yield f"login_guard_{key}", f"Login guard {key}", {}, value
+    queue_stats = finance.write_queue_stats() if finance else None
+    for key, value in (queue_stats or {}).items():
+        yield f"finance_write_queue_{key}", f"Finance group-commit writer {key}", {}, int(value) if isinstance(value, bool) else value
+
+metrics.register_collector(collect_gauges)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
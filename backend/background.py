@@ -0,0 +1,69 @@
+"""
+Daemon threads that follow the process across gunicorn's fork.
+
+A thread started before a fork doesn't run in the child, and state the
+parent queued for it belongs to the parent. BackgroundThread remembers which
+process started it: ensure() in a forked child calls on_fork (to drop the
+inherited state) and starts a fresh thread. The optional at_exit callback
+runs at interpreter exit, and only in the process whose thread it is.
+"""
+
+import atexit
+import os
+import sys
+import threading
+
+
+class BackgroundThread:
+    """
+    :param target: the thread's loop
+    :param name: thread name
+    :param on_fork: called, with the start lock held, before restarting in a forked child
+    :param at_exit: called at exit (e.g. a final flush or stop) if this process started the thread
+    """
+
+    def __init__(self, target, name, on_fork=None, at_exit=None):
+        self.target = target
+        self.name = name
+        self.on_fork = on_fork
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if at_exit is not None:
+            atexit.register(self._at_exit, at_exit)
+
+    @property
+    def owned(self) -> bool:
+        """Whether this process started the thread."""
+        return self._pid == os.getpid()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self.owned
+
+    def ensure(self):
+        """Start the thread unless it is already running in this process."""
+        if self.running:
+            return
+        if sys.is_finalizing():
+            # Threads can't be started during interpreter shutdown; at_exit has already run
+            return
+        with self._lock:
+            if self.running:
+                return
+            if self._pid is not None and not self.owned and self.on_fork is not None:
+                self.on_fork()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._thread.start()
+
+    def join(self, timeout=None):
+        if self.running:
+            self._thread.join(timeout)
+
+    def _at_exit(self, callback):
+        if self.owned:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error stopping {self.name}: {e}")
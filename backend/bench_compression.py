@@ -0,0 +1,88 @@
+"""
+Compare response size and latency per endpoint with and without compression.
+
+Requests go through the Flask test client against the configured databases,
+once per encoding the app offers plus identity. The first request of each run
+is reported separately: for ETagged responses it fills the precompressed
+cache, later ones reuse it.
+
+Usage: python bench_compression.py [--runs 50] [--user USER] [--box BOX_ID] [--term brick]
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+from app import app, compression
+import lego_db
+import settings
+
+
+def endpoints(user, box_id, term):
+    """(label, method, path, json body) for the large JSON responses."""
+    checks = [
+        ("lego boxes", "GET", "/lego/api/boxes", None),
+        ("lego inventory", "GET", "/lego/api/inventory", None),
+        ("lego piece search", "GET", f"/lego/api/piece/search?type=name&term={term}&limit={lego_db.MAX_SEARCH_LIMIT}", None),
+    ]
+    if box_id is not None:
+        checks.append(("lego box", "GET", f"/lego/api/box/{box_id}", None))
+    if user:
+        checks.append(("finance transactions", "GET", f"/finance/api/transactions?user={user}", None))
+        checks.append(("finance login", "POST", "/finance/login",
+                       {"username": user, "password": settings.current.finance_api_pw}))
+    return checks
+
+
+def measure(client, method, path, body, encoding, runs):
+    """(status, bytes, first request ms, median ms of the rest)."""
+    headers = {"Accept-Encoding": encoding}
+    timings = []
+    size = status = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body, headers=headers)
+        data = response.get_data()
+        timings.append((time.perf_counter() - start) * 1000)
+        size, status = len(data), response.status_code
+    rest = timings[1:] or timings
+    return status, size, timings[0], statistics.median(rest)
+
+
+def first_box():
+    with lego_db.get_pool().read() as conn:
+        row = conn.execute("SELECT id FROM Box ORDER BY id LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response compression per endpoint")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--user", help="finance user whose history to fetch")
+    parser.add_argument("--box", help="box id for /lego/api/box (default: first box)")
+    parser.add_argument("--term", default="brick", help="piece name search term")
+    args = parser.parse_args()
+
+    # Login requests log every call; keep the table readable
+    app.logger.setLevel(logging.WARNING)
+    box_id = args.box if args.box is not None else first_box()
+    client = app.test_client()
+    encodings = ["identity"] + list(compression.encodings())
+
+    print(f"{'endpoint':<22} {'encoding':<9} {'status':>6} {'bytes':>10} {'ratio':>6} {'first ms':>9} {'median ms':>10}")
+    for label, method, path, body in endpoints(args.user, box_id, args.term):
+        identity_size = None
+        for encoding in encodings:
+            status, size, first, median = measure(client, method, path, body, encoding, args.runs)
+            if identity_size is None:
+                identity_size = size
+            ratio = size / identity_size if identity_size else 1.0
+            print(f"{label:<22} {encoding:<9} {status:>6} {size:>10} {ratio:>6.2f} {first:>9.2f} {median:>10.2f}")
+
+    print()
+    print("compression:", compression.stats())
+
+
+if __name__ == "__main__":
+    main()
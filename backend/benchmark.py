@@ -0,0 +1,393 @@
+"""
+Benchmark and load test for the backend against large synthetic databases.
+
+generate builds a finance.db (through finance's own migrations) and a
+lego_db.db of the given sizes. run points the app at them, drives every
+database-backed route through the Flask test client one request at a time,
+then runs a mixed load from concurrent threads - against the test client, or
+against a running server with --url. Both phases report p50/p95/p99 latency
+and throughput per scenario. --save writes the results as a baseline, and
+--compare reports (and exits 1 on) p95 regressions against one.
+
+Usage:
+    python benchmark.py generate [--out data/bench] [--users 50] [--transactions 300000] [--pieces 30000]
+    python benchmark.py run [--data data/bench] [--requests 200] [--concurrency 8] [--duration 20]
+                            [--url http://localhost:5000] [--save baseline.json] [--compare baseline.json]
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+DEFAULT_DIR = os.path.join("data", "bench")
+CATEGORIES = ["Food", "Rent", "Transport", "Utilities", "Entertainment", "Health", "Travel", "Shopping", "Income", "Gifts"]
+MERCHANTS = ["Grocer", "Cafe", "Landlord", "Metro", "Power Co", "Cinema", "Pharmacy", "Airline", "Market", "Employer"]
+SHAPES = ["Brick", "Plate", "Tile", "Slope", "Technic Beam", "Round Brick", "Wedge Plate", "Bracket", "Hinge", "Panel"]
+COLORS = ["Red", "Blue", "Yellow", "Black", "White", "Light Bluish Gray", "Dark Bluish Gray", "Tan", "Green", "Orange"]
+PIECE_CATEGORIES = [f"{shape}s" for shape in SHAPES] + ["Minifig Parts", "Wheels", "Windows", "Doors", "Plants"]
+# p95 growth beyond this fraction of the baseline counts as a regression
+REGRESSION_THRESHOLD = 0.2
+
+
+def _point_app_at(data_dir):
+    """Must run before settings is first imported."""
+    os.environ["FINANCE_DB_PATH"] = os.path.join(data_dir, "finance.db")
+    os.environ["LEGO_DB_PATH"] = os.path.join(data_dir, "lego_db.db")
+    os.environ["PRIVATE_DB_PATH"] = os.path.join(data_dir, "private_finance.db")
+    os.environ.setdefault("FINANCE_API_PW", "benchmark")
+    # Measure the login route itself rather than the throttle in front of it
+    os.environ.setdefault("LOGIN_RATE_PER_MINUTE", "1000000")
+    os.environ.setdefault("LOGIN_BURST", "1000000")
+
+
+# ---------------------------------------------- generate -------------------------------------------------
+
+def create_lego_tables(path):
+    """The lego schema is created outside this repo; these tables match the columns lego_db.py queries."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE Box (id TEXT PRIMARY KEY);
+        CREATE TABLE Position (id TEXT PRIMARY KEY);
+        CREATE TABLE Piece (part_number TEXT PRIMARY KEY, name TEXT, category TEXT);
+        CREATE TABLE Container (
+            id TEXT PRIMARY KEY,
+            box_id TEXT REFERENCES Box(id),
+            position_id TEXT REFERENCES Position(id)
+        );
+        CREATE TABLE ContainerPiece (
+            container_id TEXT REFERENCES Container(id),
+            part_number TEXT REFERENCES Piece(part_number)
+        );
+    """)
+    conn.close()
+
+def generate(out, users, transactions, pieces, boxes, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(out, exist_ok=True)
+    for name in ("finance.db", "lego_db.db"):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(os.path.join(out, name + suffix)):
+                os.remove(os.path.join(out, name + suffix))
+    _point_app_at(out)
+    create_lego_tables(os.path.join(out, "lego_db.db"))
+
+    # Imported only now, so their import-time migrations run on the new files
+    import finance
+    import lego_db
+
+    start = time.perf_counter()
+    names = [f"user{i:03}" for i in range(users)]
+    # A few heavy users, a long tail of light ones
+    weights = [1 / (rank + 1) for rank in range(users)]
+    first_day = datetime(2020, 1, 1)
+    batch = []
+    for i in range(transactions):
+        merchant = rng.choice(MERCHANTS)
+        batch.append({
+            "user": rng.choices(names, weights)[0],
+            "category": rng.choice(CATEGORIES),
+            "amount": round(rng.uniform(-500, 2000), 2),
+            "date_obj": first_day + timedelta(minutes=rng.randrange(6 * 365 * 24 * 60)),
+            "title": f"{merchant} #{rng.randrange(1000)}",
+            "description": f"Synthetic {merchant.lower()} transaction",
+            "rate": None,
+        })
+        if len(batch) == 10000 or i == transactions - 1:
+            finance.insert_transactions(batch)
+            batch = []
+    print(f"finance.db: {transactions} transactions for {users} users in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    box_ids = [f"{chr(65 + i % 26)}{i // 26 or ''}" for i in range(boxes)]
+    positions = [f"{row}{col}" for row in "ABCDEFGH" for col in range(1, 9)]
+    with lego_db.get_pool().write() as conn:
+        conn.executemany("INSERT INTO Box VALUES (?)", [(b,) for b in box_ids])
+        conn.executemany("INSERT INTO Position VALUES (?)", [(p,) for p in positions])
+        containers = []
+        for box in box_ids:
+            for position in positions:
+                containers.append((f"c{len(containers) + 1:03}", box, position))
+        conn.executemany("INSERT INTO Container VALUES (?, ?, ?)", containers)
+
+        parts = []
+        for i in range(pieces):
+            shape = rng.choice(SHAPES)
+            size = f"{rng.randint(1, 4)} x {rng.randint(1, 8)}"
+            parts.append((f"{3000 + i}{rng.choice(['', 'a', 'b', 'pr01'])}", f"{shape} {size} {rng.choice(COLORS)}",
+                          f"{shape}s" if rng.random() < 0.8 else rng.choice(PIECE_CATEGORIES)))
+        conn.executemany("INSERT OR IGNORE INTO Piece VALUES (?, ?, ?)", parts)
+        # Most parts stored once, some in two containers, about 5% not stored at all
+        stored = []
+        for part_number, _, _ in parts:
+            roll = rng.random()
+            if roll < 0.05:
+                continue
+            for _ in range(2 if roll > 0.9 else 1):
+                stored.append((rng.choice(containers)[0], part_number))
+        conn.executemany("INSERT INTO ContainerPiece VALUES (?, ?)", stored)
+        lego_db.create_search_index(conn)
+    print(f"lego_db.db: {pieces} pieces in {len(containers)} containers across {boxes} boxes "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+# ---------------------------------------------- scenarios -------------------------------------------------
+
+def load_keys(finance, lego_db):
+    """Users, boxes, containers, parts and words that exist in the benchmark databases."""
+    with finance.get_pool().read() as conn:
+        users = [row[0] for row in conn.execute("SELECT DISTINCT user FROM transactions LIMIT 200")]
+        transaction_ids = [row[0] for row in conn.execute("SELECT id FROM transactions ORDER BY random() LIMIT 500")]
+    with lego_db.get_pool().read() as conn:
+        boxes = [row[0] for row in conn.execute("SELECT id FROM Box")]
+        containers = [row[0] for row in conn.execute("SELECT id FROM Container ORDER BY random() LIMIT 500")]
+        parts = [row[0] for row in conn.execute("SELECT part_number FROM Piece ORDER BY random() LIMIT 2000")]
+        categories = [row[0] for row in conn.execute("SELECT DISTINCT category FROM Piece")]
+    return {"users": users, "transaction_ids": transaction_ids, "boxes": boxes, "containers": containers,
+            "parts": parts, "categories": categories}
+
+def scenarios(keys, password):
+    """
+    name -> function(rng) returning (method, path, json body, headers). Covers
+    every route that reaches a database; writes go last in the mix weights.
+    """
+    def user(rng):
+        return rng.choice(keys["users"])
+
+    def transaction(rng):
+        return {"User": user(rng), "Category": rng.choice(CATEGORIES), "Amount": round(rng.uniform(1, 100), 2),
+                "Date": datetime.now().strftime("%b %d, %Y at %I:%M %p"), "Title": "Benchmark"}
+
+    auth = {"pw": password}
+    return {
+        "transactions": lambda rng: ("GET", f"/finance/api/transactions?user={user(rng)}", None, {}),
+        "transactions_page": lambda rng: ("GET", f"/finance/api/transactions?user={user(rng)}&limit=100", None, {}),
+        "transactions_ndjson": lambda rng: ("GET", f"/finance/api/transactions?user={user(rng)}&format=ndjson", None, {}),
+        "summary": lambda rng: ("GET", f"/finance/api/summary?user={user(rng)}", None, {}),
+        "login": lambda rng: ("POST", "/finance/login", {"username": user(rng), "password": password}, {}),
+        "login_page": lambda rng: ("POST", "/finance/login", {"username": user(rng), "password": password, "limit": 100}, {}),
+        "boxes": lambda rng: ("GET", "/lego/api/boxes", None, {}),
+        "box": lambda rng: ("GET", f"/lego/api/box/{rng.choice(keys['boxes'])}", None, {}),
+        "inventory": lambda rng: ("GET", "/lego/api/inventory", None, {}),
+        "container": lambda rng: ("GET", f"/lego/api/container/{rng.choice(keys['containers'])}", None, {}),
+        "positions": lambda rng: ("GET", "/lego/api/positions", None, {}),
+        "categories": lambda rng: ("GET", "/lego/api/categories", None, {}),
+        "search_part": lambda rng: ("GET", f"/lego/api/piece/search?type=part_number&term={rng.choice(keys['parts'])}", None, {}),
+        "search_name": lambda rng: ("GET", f"/lego/api/piece/search?type=name&term={rng.choice(SHAPES).split()[0]}+{rng.randint(1, 4)}", None, {}),
+        "search_category": lambda rng: ("GET", f"/lego/api/piece/search?type=category&term={rng.choice(keys['categories'])}", None, {}),
+        "lookup": lambda rng: ("POST", "/lego/api/piece/lookup", {"part_numbers": rng.sample(keys["parts"], 50)}, {}),
+        "insert": lambda rng: ("POST", "/finance/api", transaction(rng), auth),
+        "batch_insert": lambda rng: ("POST", "/finance/api/batch", [transaction(rng) for _ in range(20)], auth),
+        "edit": lambda rng: ("POST", "/finance/edit", {"id": rng.choice(keys["transaction_ids"]), "title": "Edited",
+                                                      "amount": 1.0, "category": "Food", "date": "2024-01-01 12:00"}, {}),
+    }
+
+# Relative frequency of each scenario in the load phase: mostly reads
+MIX = {"transactions_page": 10, "summary": 8, "login_page": 5, "transactions": 2, "login": 2, "transactions_ndjson": 1,
+       "boxes": 5, "box": 10, "inventory": 2, "container": 10, "positions": 3, "categories": 3,
+       "search_part": 10, "search_name": 8, "search_category": 5, "lookup": 3,
+       "insert": 2, "batch_insert": 1, "edit": 1}
+
+
+# ---------------------------------------------- clients -------------------------------------------------
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body, headers):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers)
+        response.get_data()
+        return response.status_code
+
+class HTTPDriver:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body, headers):
+        import urllib.error
+        import urllib.request
+
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={**headers, **({"Content-Type": "application/json"} if data else {})})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+# ---------------------------------------------- measurement -------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies, errors, elapsed) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3) if values else None,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else None,
+    }
+
+def timed(driver, request):
+    start = time.perf_counter()
+    status = driver.request(*request)
+    return time.perf_counter() - start, status >= 400
+
+def run_sequential(driver, scenario_map, requests, seed=0) -> dict:
+    """Each scenario on its own, one request at a time."""
+    rng = random.Random(seed)
+    results = {}
+    for name, make in scenario_map.items():
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            elapsed, failed = timed(driver, make(rng))
+            latencies.append(elapsed)
+            errors += failed
+        results[name] = summarize(latencies, errors, time.perf_counter() - start)
+    return results
+
+def run_load(driver, scenario_map, concurrency, duration, seed=0) -> dict:
+    """The MIX of scenarios from concurrent threads for duration seconds."""
+    names = [name for name in MIX if name in scenario_map]
+    weights = [MIX[name] for name in names]
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            elapsed, failed = timed(driver, scenario_map[name](rng))
+            with lock:
+                latencies[name].append(elapsed)
+                errors[name] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    results = {name: summarize(latencies[name], errors[name], elapsed) for name in names}
+    results["ALL"] = summarize([v for values in latencies.values() for v in values], sum(errors.values()), elapsed)
+    return results
+
+
+# ---------------------------------------------- reporting -------------------------------------------------
+
+def print_table(title, results):
+    print(f"\n{title}")
+    print(f"{'scenario':<22} {'requests':>8} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for name, r in results.items():
+        print(f"{name:<22} {r['requests']:>8} {r['errors']:>6} {r['p50_ms'] or 0:>9.2f} {r['p95_ms'] or 0:>9.2f} "
+              f"{r['p99_ms'] or 0:>9.2f} {r['throughput_rps'] or 0:>9.1f}")
+
+def compare(baseline, results, threshold=REGRESSION_THRESHOLD) -> list:
+    """Scenarios whose p95 grew by more than threshold compared to the baseline."""
+    regressions = []
+    for phase in ("sequential", "load"):
+        for name, r in results.get(phase, {}).items():
+            before = baseline.get(phase, {}).get(name)
+            if not before or not before.get("p95_ms") or r["p95_ms"] is None:
+                continue
+            change = r["p95_ms"] / before["p95_ms"] - 1
+            marker = "REGRESSION" if change > threshold else ""
+            print(f"{phase:<10} {name:<22} p95 {before['p95_ms']:>9.2f} -> {r['p95_ms']:>9.2f} ms ({change:+.0%}) {marker}")
+            if marker:
+                regressions.append((phase, name, change))
+    return regressions
+
+def run(args) -> int:
+    # Request parameters are drawn from the local copy even when --url targets a server
+    _point_app_at(args.data)
+    if not os.path.exists(os.path.join(args.data, "lego_db.db")):
+        print(f"No benchmark databases in {args.data}; run 'python benchmark.py generate' first.")
+        return 1
+    import logging
+    import finance
+    import lego_db
+    import settings
+
+    keys = load_keys(finance, lego_db)
+    if args.url:
+        driver = HTTPDriver(args.url)
+    else:
+        from app import app
+        # Request logging would dominate the timings
+        app.logger.setLevel(logging.WARNING)
+        driver = TestClientDriver(app)
+    scenario_map = scenarios(keys, settings.current.finance_api_pw)
+    if args.only:
+        scenario_map = {name: make for name, make in scenario_map.items() if name in args.only}
+
+    results = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "target": args.url or "test client",
+                 "requests": args.requests, "concurrency": args.concurrency, "duration": args.duration},
+        "sequential": run_sequential(driver, scenario_map, args.requests),
+    }
+    print_table("Sequential (one request at a time)", results["sequential"])
+    if args.duration > 0:
+        results["load"] = run_load(driver, scenario_map, args.concurrency, args.duration)
+        print_table(f"Load ({args.concurrency} threads for {args.duration}s)", results["load"])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.save}.")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare} ({baseline.get('meta', {}).get('date')}):")
+        if compare(baseline, results):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Backend benchmark and load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gen = commands.add_parser("generate", help="build synthetic finance.db and lego_db.db")
+    gen.add_argument("--out", default=DEFAULT_DIR)
+    gen.add_argument("--users", type=int, default=50)
+    gen.add_argument("--transactions", type=int, default=300000)
+    gen.add_argument("--pieces", type=int, default=30000)
+    gen.add_argument("--boxes", type=int, default=40)
+    gen.add_argument("--seed", type=int, default=0)
+    bench = commands.add_parser("run", help="benchmark every route against the synthetic databases")
+    bench.add_argument("--data", default=DEFAULT_DIR)
+    bench.add_argument("--url", help="benchmark a running server instead of the in-process test client")
+    bench.add_argument("--requests", type=int, default=200, help="requests per scenario in the sequential phase")
+    bench.add_argument("--concurrency", type=int, default=8)
+    bench.add_argument("--duration", type=float, default=20, help="seconds of mixed load; 0 skips the load phase")
+    bench.add_argument("--only", nargs="+", help="scenario names to run")
+    bench.add_argument("--save", help="write results to this baseline file")
+    bench.add_argument("--compare", help="baseline file to compare p95 latencies against")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate(args.out, args.users, args.transactions, args.pieces, args.boxes, args.seed)
+    elif args.command == "run":
+        sys.exit(run(args))
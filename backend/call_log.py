@@ -0,0 +1,417 @@
+"""
+Structured API call log, replacing the plain-text data/calls.txt.
+
+Each call is one NDJSON record, {"ts": ..., "event": ..., "user_id": ..., ...}.
+log_call() only queues the record; a background thread writes queued records
+in batches to <call_log_dir>/calls.ndjson. The active file is rotated once it
+passes settings.call_log_max_bytes or its first record is older than
+settings.call_log_rotate_seconds. The rotated segment is renamed to
+calls-<first ts>-<last ts>.ndjson under the lock and gzipped to
+.ndjson.gz outside it; a segment left uncompressed by a crash is finished
+by the next rotation, and is readable meanwhile. Writes and rotation take an
+flock on the directory, so every gunicorn worker can log to the same files.
+
+query() reads only the segments whose time range overlaps the request and
+binary-searches the active file for the start time.
+
+Usage:
+    python call_log.py query [--event E] [--user U] [--since ISO] [--until ISO]
+    python call_log.py import data/calls.txt
+    python call_log.py rotate
+"""
+
+import fcntl
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+import settings
+from background import BackgroundThread
+from logtail import tail_lines
+
+ACTIVE_NAME = "calls.ndjson"
+LOCK_NAME = ".lock"
+SEGMENT_RE = re.compile(r"^calls-(\d{8}T\d{6})-(\d{8}T\d{6})(?:\.\d+)?\.ndjson(\.gz)?$")
+SEGMENT_TIME = "%Y%m%dT%H%M%S"
+MAX_BATCH = 256
+FLUSH_INTERVAL = 1.0
+# Workers flush independently, so records in the active file are only roughly
+# ordered; the start-time search backs off by this much to be safe
+ORDER_SLACK = timedelta(seconds=10)
+
+_STOP = object()
+
+
+def _parse_ts(value) -> datetime | None:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CallLogger:
+    """
+    :param directory: where the active file and rotated segments live
+    :param max_bytes: rotate once the active file is at least this large
+    :param rotate_seconds: rotate once the active file's first record is this old
+    """
+
+    def __init__(self, directory, max_bytes, rotate_seconds,
+                 max_batch=MAX_BATCH, flush_interval=FLUSH_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = BackgroundThread(self._run, "call-logger", on_fork=self._reset, at_exit=self.stop)
+        self.written = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+
+    @property
+    def active_path(self) -> str:
+        return os.path.join(self.directory, ACTIVE_NAME)
+
+    @property
+    def running(self) -> bool:
+        return self._thread.running
+
+    def start(self):
+        self._thread.ensure()
+
+    def _reset(self):
+        # Records queued before a fork are the parent's to write
+        self._queue = queue.Queue()
+
+    def stop(self, timeout=5):
+        """Write everything queued so far and stop the writer thread."""
+        if self.running:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def log(self, event, user_id=None, **fields):
+        """Queue one call record; never blocks on disk."""
+        if not self.running:
+            self.start()
+        record = {"ts": datetime.now().isoformat(), "event": event, "user_id": user_id, **fields}
+        self._queue.put(record)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            stopping = first is _STOP
+            batch = [] if stopping else [first]
+            while not stopping and len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if stopping:
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Error writing call log: {e}")
+            if stopping:
+                return
+
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, LOCK_NAME), "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def write(self, records, rotate=True):
+        """Append records to the active file in one write, rotating first if it is due."""
+        data = "".join(json.dumps(record, default=str) + "\n" for record in records).encode()
+        with self._locked():
+            segment = self._rotate_if_due() if rotate else None
+            with open(self.active_path, "ab") as f:
+                f.write(data)
+        self.written += len(records)
+        self.batches += 1
+        if segment:
+            self._compress_pending()
+
+    def rotate(self):
+        """Rotate the active file now, whatever its size or age."""
+        with self._locked():
+            segment = self._rotate_if_due(force=True)
+        if segment:
+            self._compress_pending()
+        return segment
+
+    def _rotate_if_due(self, force=False) -> str | None:
+        """Rename the active file to its segment name; call with the lock held. Returns the renamed path."""
+        try:
+            size = os.path.getsize(self.active_path)
+        except FileNotFoundError:
+            return None
+        if size == 0:
+            return None
+        first, last = self._time_range()
+        if not force and size < self.max_bytes:
+            if first is None or (datetime.now() - first).total_seconds() < self.rotate_seconds:
+                return None
+
+        first = first or datetime.now()
+        last = last or first
+        base = os.path.join(self.directory, f"calls-{first.strftime(SEGMENT_TIME)}-{last.strftime(SEGMENT_TIME)}")
+        path = base + ".ndjson"
+        # Segments covering the same seconds (forced rotations) get a numeric suffix
+        n = 1
+        while os.path.exists(path) or os.path.exists(path + ".gz"):
+            n += 1
+            path = f"{base}.{n}.ndjson"
+        os.replace(self.active_path, path)
+        self.rotations += 1
+        return path
+
+    def _time_range(self):
+        """Timestamps of the first and last records in the active file."""
+        with open(self.active_path, "rb") as f:
+            first = _record_ts(f.readline())
+        last = None
+        for line in tail_lines(self.active_path, 1):
+            last = _record_ts(line)
+        if first and last and last < first:
+            last = first
+        return first, last
+
+    def _compress_pending(self):
+        """Gzip every uncompressed segment: the one just rotated and any a crash left behind."""
+        for name in os.listdir(self.directory):
+            match = SEGMENT_RE.match(name)
+            if match and match.group(3) is None:
+                self._compress(os.path.join(self.directory, name))
+
+    def _compress(self, path):
+        gz_path = path + ".gz"
+        # Another worker may be finishing the same leftover segment
+        tmp = f"{gz_path}.{os.getpid()}.tmp"
+        try:
+            # The .gz only gets its name once complete, so a crash after that just leaves the source
+            if not os.path.exists(gz_path):
+                with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp, gz_path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.errors += 1
+            print(f"Error compressing {path}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
+
+
+def _record_ts(line) -> datetime | None:
+    try:
+        return _parse_ts(json.loads(line).get("ts"))
+    except (ValueError, AttributeError):
+        return None
+
+
+def segments(directory) -> list:
+    """(first, last, path) for every rotated segment, compressed or not, oldest first."""
+    found = []
+    names = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+    for name in names:
+        match = SEGMENT_RE.match(name)
+        # Mid-compression both forms exist; the .gz is complete once it has its final name
+        if match and not (match.group(3) is None and name + ".gz" in names):
+            first = datetime.strptime(match.group(1), SEGMENT_TIME)
+            # Names are truncated to the second
+            last = datetime.strptime(match.group(2), SEGMENT_TIME) + timedelta(seconds=1)
+            found.append((first, last, os.path.join(directory, name)))
+    return sorted(found)
+
+
+def _line_start(f, position) -> int:
+    """Offset of the first line starting at or after position."""
+    if position == 0:
+        return 0
+    f.seek(position - 1)
+    f.readline()
+    return f.tell()
+
+
+def _seek_since(f, since):
+    """Position f at the first line whose timestamp is at or after since (by binary search)."""
+    lo, hi = 0, os.fstat(f.fileno()).st_size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(_line_start(f, mid))
+        line = f.readline()
+        ts = _record_ts(line) if line else None
+        if not line or (ts is not None and ts >= since):
+            hi = mid
+        else:
+            lo = mid + 1
+    f.seek(_line_start(f, lo))
+
+
+def _matches(record, event, user_id, since, until) -> bool:
+    if event is not None and record.get("event") != event:
+        return False
+    if user_id is not None and str(record.get("user_id")) != str(user_id):
+        return False
+    if since is not None or until is not None:
+        ts = _parse_ts(record.get("ts"))
+        if ts is None or (since is not None and ts < since) or (until is not None and ts >= until):
+            return False
+    return True
+
+
+def query(event=None, user_id=None, since=None, until=None, directory=None):
+    """
+    Yield call records matching every given filter, oldest segment first.
+
+    :param event: exact event name
+    :param user_id: user id (compared as a string)
+    :param since: datetime, inclusive
+    :param until: datetime, exclusive
+    """
+    directory = directory or settings.current.call_log_dir
+    for first, last, path in segments(directory):
+        # Segment names come from the first and last lines, which are only roughly the extremes
+        if (since is not None and last + ORDER_SLACK < since) or (until is not None and first - ORDER_SLACK >= until):
+            continue
+        with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+            for line in f:
+                yield from _filter_line(line, event, user_id, since, until)
+
+    active = os.path.join(directory, ACTIVE_NAME)
+    try:
+        f = open(active, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        if since is not None:
+            _seek_since(f, since - ORDER_SLACK)
+        for line in f:
+            yield from _filter_line(line, event, user_id, since, until)
+
+
+def _filter_line(line, event, user_id, since, until):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return
+    if isinstance(record, dict) and _matches(record, event, user_id, since, until):
+        yield record
+
+
+LEGACY_LINE = re.compile(r"^\[(?P<ts>[^\]]+)\]\s+(?P<event>[^|]+?)\s*(?:\|(?P<rest>.*))?$")
+
+def parse_legacy_line(line) -> dict | None:
+    """Turn '[ts] event | user_id=1 | key=value | free text' into a record."""
+    match = LEGACY_LINE.match(line.strip())
+    if not match:
+        return None
+    record = {"ts": match.group("ts"), "event": match.group("event"), "user_id": None}
+    notes = []
+    for part in (match.group("rest") or "").split("|"):
+        part = part.strip()
+        key, sep, value = part.partition("=")
+        if sep and key and " " not in key:
+            record[key] = value
+        elif part:
+            notes.append(part)
+    if notes:
+        record["detail"] = " | ".join(notes)
+    return record
+
+
+def import_legacy(path, logger) -> int:
+    """
+    Copy the records of an old calls.txt into a rotated segment of their own;
+    returns the number imported.
+    """
+    # Close off current records first so the segment holds only the old file
+    logger.rotate()
+    batch, count = [], 0
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            record = parse_legacy_line(line)
+            if record is None:
+                continue
+            batch.append(record)
+            if len(batch) >= MAX_BATCH:
+                logger.write(batch, rotate=False)
+                count += len(batch)
+                batch = []
+    if batch:
+        logger.write(batch, rotate=False)
+        count += len(batch)
+    logger.rotate()
+    return count
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+def get_logger() -> CallLogger:
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            _logger = CallLogger(
+                settings.current.call_log_dir,
+                max_bytes=settings.current.call_log_max_bytes,
+                rotate_seconds=settings.current.call_log_rotate_seconds
+            )
+        return _logger
+
+def log_call(event, user_id=None, **fields):
+    """Record an API call, e.g. log_call("transactions_sync", user_id=1, account_id=..., cursor="initial")."""
+    get_logger().log(event, user_id, **fields)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Structured API call log")
+    commands = parser.add_subparsers(dest="command", required=True)
+    find = commands.add_parser("query", help="print matching records as NDJSON")
+    find.add_argument("--event")
+    find.add_argument("--user")
+    find.add_argument("--since", type=datetime.fromisoformat, help="ISO time, inclusive")
+    find.add_argument("--until", type=datetime.fromisoformat, help="ISO time, exclusive")
+    legacy = commands.add_parser("import", help="convert a plain-text calls.txt")
+    legacy.add_argument("path")
+    commands.add_parser("rotate", help="rotate and compress the active file now")
+    args = parser.parse_args()
+
+    if args.command == "query":
+        for record in query(args.event, args.user, args.since, args.until):
+            print(json.dumps(record))
+    elif args.command == "import":
+        count = import_legacy(args.path, get_logger())
+        print(f"Imported {count} records into {settings.current.call_log_dir}.")
+    elif args.command == "rotate":
+        segment = get_logger().rotate()
+        print(f"Rotated to {segment}.gz." if segment else "Nothing to rotate.")
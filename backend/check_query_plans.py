@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Query plan check - fails if any query issued by finance.py or lego_db.py
+needs a full table scan.
+
+Runs against throwaway copies: a freshly migrated finance database and a
+backup of the lego database (whose tables are created outside this repo),
+migrated to the latest version. Every helper is exercised with sample data,
+the SQL actually sent to SQLite is captured with a trace callback, and each
+statement is run through EXPLAIN QUERY PLAN.
+
+Usage: python check_query_plans.py [path/to/lego_db.db]
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+import db_pool
+import finance
+import lego_db
+
+# Statements where scanning is the point, matched against the traced SQL
+ALLOWED_SCANS = [
+    (r"LIKE '%", "substring fallback for terms too short for the trigram index"),
+    (r"GROUP BY lower\(user\)", "rebuild_summary recomputes every row"),
+    (r"FROM Box b\s+LEFT JOIN Container", "get_inventory exports every box"),
+    (r"\bsqlite_master\b", "schema lookups"),
+    (r"'main'\.'", "statements FTS5 issues against its own shadow tables"),
+]
+
+def plan_violations(conn, sql):
+    """Return the SCAN details of a statement's query plan, ignoring subqueries and virtual tables."""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    subqueries = {m.group(1) for _, _, _, detail in rows
+                  if (m := re.match(r"(?:CO-ROUTINE|MATERIALIZE) (\w+)", detail))}
+    violations = []
+    for _, _, _, detail in rows:
+        m = re.match(r"SCAN (\w+)", detail)
+        if not m or m.group(1) in subqueries or "VIRTUAL TABLE" in detail:
+            continue
+        violations.append(detail)
+    return violations
+
+def exercise_finance():
+    now = datetime(2025, 1, 15, 12, 0)
+    finance.insert_transaction("checker", "Food", 1.0, now, "a", "", None)
+    finance.insert_transactions([
+        {"user": "checker", "category": "Rent", "amount": 2.0, "date_obj": now, "title": "b"},
+    ])
+    finance.insert_unique_transactions([
+        {"user": "checker", "category": "Food", "amount": 4.0, "date_obj": now, "title": "c", "content_hash": "checker-c"},
+    ])
+    finance.get_transactions_by_user("checker")
+    finance.get_user_version("checker")
+    rows, _ = finance.get_transactions_page("checker", limit=1)
+    finance.get_transactions_page("checker", limit=1, cursor=finance.encode_cursor(rows[0][2], rows[0][6]))
+    list(finance.iter_transactions_by_user("checker"))
+    list(finance.iter_transactions_by_user("checker", start="2025-01-01", end="2025-01-31"))
+    list(finance.iter_transactions_by_user("checker", start="2025-01-01", categories=["Food", "Rent"]))
+    finance.get_summary("checker", "2025-01", "2025-12")
+    finance.edit_transaction_by_id(rows[0][6], amount=3.0)
+    finance.delete_transaction_by_id(rows[0][6])
+    with finance.get_pool().write() as conn:
+        finance.rebuild_summary(conn)
+
+def lego_sample():
+    """One container and one piece to feed the lego helpers."""
+    with lego_db.get_pool().read() as conn:
+        container = conn.execute("SELECT id, box_id, position_id FROM Container LIMIT 1").fetchone()
+        piece = conn.execute("SELECT part_number, name, category FROM Piece LIMIT 1").fetchone()
+    if not container or not piece:
+        raise SystemExit("Lego database needs at least one Container and Piece to exercise queries")
+    return container, piece
+
+def exercise_lego(sample):
+    (container_id, box_id, position_id), (part_number, name, category) = sample
+    with lego_db.get_pool().read() as conn:
+        lego_db.get_container_at_location(conn, box_id, position_id)
+        lego_db.get_container_from_id(conn, container_id)
+        lego_db.get_containers_location(conn, container_id)
+        lego_db.get_contents_of_box(conn, box_id)
+        lego_db.get_pieces_in_container(conn, container_id)
+        lego_db.get_containers_with_piece(conn, part_number)
+        lego_db.get_piece(conn, part_number)
+        lego_db.search_piece(conn, part_number=part_number)
+        lego_db.search_piece(conn, name=(name or "brick")[:5])
+        lego_db.search_piece(conn, category=(category or "brick")[:5])
+        lego_db.search_piece(conn, name="ab")
+        lego_db.get_inventory(conn)
+        lego_db.locate_pieces(conn, [part_number, "no-such-part"])
+
+def main():
+    lego_source = sys.argv[1] if len(sys.argv) > 1 else lego_db.DB_FILE
+    if not os.path.exists(lego_source):
+        print(f"Lego database not found: {lego_source}")
+        return 2
+
+    workdir = tempfile.mkdtemp(prefix="query_plans_")
+    finance.DB_FILE = os.path.join(workdir, "finance.db")
+    lego_db.DB_FILE = os.path.join(workdir, "lego_db.db")
+    source = sqlite3.connect(lego_source)
+    target = sqlite3.connect(lego_db.DB_FILE)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    statements = {}
+    def trace(conn, db_path):
+        if os.path.dirname(os.path.abspath(db_path)) == workdir:
+            conn.set_trace_callback(lambda sql: statements.setdefault(sql.strip(), db_path))
+    db_pool.CONNECT_HOOKS.append(trace)
+
+    finance.migrate()
+    # Migration 2 builds PieceSearch
+    lego_db.migrate()
+    sample = lego_sample()
+    statements.clear()
+
+    exercise_finance()
+    exercise_lego(sample)
+    db_pool.CONNECT_HOOKS.remove(trace)
+    captured = list(statements.items())
+
+    failures = 0
+    checked = 0
+    for sql, db_path in captured:
+        if not re.match(r"(WITH|SELECT|UPDATE|DELETE|INSERT)\b", sql, re.IGNORECASE):
+            continue
+        if any(re.search(pattern, sql) for pattern, _ in ALLOWED_SCANS):
+            continue
+        checked += 1
+        with db_pool.get_pool(db_path).read() as conn:
+            conn.set_trace_callback(None)
+            violations = plan_violations(conn, sql)
+        if violations:
+            failures += 1
+            print(f"FULL SCAN in {os.path.basename(db_path)}:\n  {' '.join(sql.split())}")
+            for detail in violations:
+                print(f"    {detail}")
+
+    print(f"Checked {checked} statements, {failures} with full scans.")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Response compression for the Flask app.
+
+Negotiates brotli or gzip from Accept-Encoding and compresses eligible bodies
+after the view has run. Bodies under min_bytes, streamed responses, files
+sent with send_file and already-encoded responses pass through untouched.
+
+Responses that carry an ETag (the cached lego endpoints, ETagged transaction
+reads) are the same bytes every time, so their compressed form is kept in an
+LRU keyed by (ETag, encoding) and reused instead of compressing again. As the
+compressed bytes differ from the identity body, the ETag is made weak, which
+If-None-Match still matches.
+
+brotli is optional; without it only gzip is offered.
+"""
+
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+    print("Warning: brotli not installed; responses are compressed with gzip only.")
+
+COMPRESSIBLE = ("application/json", "application/x-ndjson", "text/", "application/javascript", "image/svg+xml")
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class Compression:
+    """
+    :param min_bytes: leave bodies smaller than this uncompressed
+    :param cache_bytes: bound on the precompressed body cache
+    """
+
+    def __init__(self, app=None, min_bytes=1024, cache_bytes=32 * 1024 * 1024):
+        self.min_bytes = min_bytes
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def encodings(self):
+        return ("br", "gzip") if brotli is not None else ("gzip",)
+
+    def choose_encoding(self):
+        """Best encoding the client accepts, or None."""
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for encoding in self.encodings():
+            quality = accepted[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def after_request(self, response):
+        if (response.status_code != 200
+                or response.direct_passthrough
+                or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or not response.mimetype.startswith(COMPRESSIBLE)):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_bytes:
+            return response
+
+        etag, weak = response.get_etag()
+        compressed = self._cached(etag, encoding) if etag else None
+        if compressed is None:
+            compressed = _compress(body, encoding)
+            if etag:
+                self._store(etag, encoding, compressed)
+
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _cached(self, etag, encoding):
+        with self._lock:
+            compressed = self._cache.get((etag, encoding))
+            if compressed is not None:
+                self._cache.move_to_end((etag, encoding))
+                self.cache_hits += 1
+            return compressed
+
+    def _store(self, etag, encoding, compressed):
+        if len(compressed) > self.cache_bytes:
+            return
+        with self._lock:
+            key = (etag, encoding)
+            if key in self._cache:
+                return
+            self._cache[key] = compressed
+            self._cached_bytes += len(compressed)
+            while self._cached_bytes > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "encodings": list(self.encodings()),
+                "compressed": self.compressed,
+                "cache_hits": self.cache_hits,
+                "cache_entries": len(self._cache),
+                "cache_bytes": self._cached_bytes,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+            }
@@ -8,8 +8,14 @@ Manage locked accounts and banned IPs from failed login attempts.
 import sqlite3
 import os
 import sys
+import json
 from datetime import datetime
 
+# logtail.py and security_rollups.py live in the backend directory, one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logtail import tail_lines, follow
+from security_rollups import window_stats
+
 DB_PATH = os.getenv("PRIVATE_DB_PATH", "private_finance.db")
 LOGINS_LOG_PATH = os.getenv("LOGINS_LOG_PATH", "logins.txt")
 
@@ -19,12 +25,20 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+def until(row, column):
+    """End time of a lock or ban; rows from before expiry times, or set by hand without one, last until removed."""
+    value = row[column] if column in row.keys() else None
+    if value is None:
+        return "until removed"
+    expired = value <= datetime.now().isoformat(sep=" ")
+    return f"{value} (expired)" if expired else value
+
 def list_locked_accounts():
     """Show all locked accounts"""
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT username, locked_at, failed_attempts 
+        SELECT *
         FROM locked_accounts 
         ORDER BY locked_at DESC
     """)
@@ -41,6 +55,7 @@ def list_locked_accounts():
     for row in locked:
         print(f"Username: {row['username']}")
         print(f"  Locked at: {row['locked_at']}")
+        print(f"  Locked until: {until(row, 'locked_until')}")
         print(f"  Failed attempts: {row['failed_attempts']}")
         print("-" * 80)
     print()
@@ -50,7 +65,7 @@ def list_banned_ips():
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT ip_address, banned_at, reason 
+        SELECT *
         FROM banned_ips 
         ORDER BY banned_at DESC
     """)
@@ -67,13 +82,15 @@ def list_banned_ips():
     for row in banned:
         print(f"IP Address: {row['ip_address']}")
         print(f"  Banned at: {row['banned_at']}")
+        print(f"  Banned until: {until(row, 'banned_until')}")
         print(f"  Reason: {row['reason']}")
         print("-" * 80)
     print()
 
 def unlock_account():
     """Unlock a specific account"""
-    username = input("Enter username to unlock: ").strip()
+    # The backend stores usernames lowercased
+    username = input("Enter username to unlock: ").strip().lower()
     
     if not username:
         print("No username entered.")
@@ -167,42 +184,49 @@ def view_recent_attempts():
     print(f"RECENT LOGIN ATTEMPTS (last {lines})")
     print("="*80 + "\n")
     
-    with open(LOGINS_LOG_PATH, 'r') as f:
-        all_lines = f.readlines()
-        recent = all_lines[-lines:] if len(all_lines) > lines else all_lines
-        
-        for line in recent:
-            print(line.rstrip())
+    for line in tail_lines(LOGINS_LOG_PATH, lines):
+        print(line)
     
     print("\n" + "="*80 + "\n")
 
-def show_stats():
-    """Show security statistics"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) as count FROM locked_accounts")
-    locked = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT COUNT(*) as count FROM banned_ips")
-    banned = cursor.fetchone()['count']
-    
-    # Recent failed attempts (last 24 hours)
-    one_day_ago = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    cursor.execute("""
-        SELECT COUNT(*) as count FROM failed_logins 
-        WHERE attempt_time > ?
-    """, (one_day_ago,))
-    recent_fails = cursor.fetchone()['count']
+def follow_attempts():
+    """Stream login attempts as they are appended"""
+    print("\n" + "="*80)
+    print("FOLLOWING LOGIN ATTEMPTS (Ctrl+C to stop)")
+    print("="*80 + "\n")
     
-    conn.close()
+    try:
+        for line in follow(LOGINS_LOG_PATH):
+            print(line, flush=True)
+    except KeyboardInterrupt:
+        print("\nStopped following.\n")
+
+def get_stats(hours=24, top=10):
+    """Windowed stats from the hourly rollup tables (created by the backend's migrations)"""
+    conn = get_db()
+    try:
+        return window_stats(conn, hours, top)
+    finally:
+        conn.close()
+
+def show_stats(hours=24, top=5):
+    """Show security statistics"""
+    try:
+        stats = get_stats(hours, top)
+    except sqlite3.OperationalError as e:
+        print(f"\n✗ Could not read security rollups ({e}). Start the backend once to migrate the database.\n")
+        return
     
     print("\n" + "="*80)
     print("SECURITY STATISTICS")
     print("="*80)
-    print(f"Locked accounts: {locked}")
-    print(f"Banned IPs: {banned}")
-    print(f"Failed attempts (today): {recent_fails}")
+    print(f"Locked accounts: {stats['locked_accounts']}")
+    print(f"Banned IPs: {stats['banned_ips']}")
+    print(f"Failed attempts (last {hours} hours): {stats['failed_attempts']}")
+    if stats['top_ips']:
+        print("Top IPs: " + ", ".join(f"{row['ip_address']} ({row['attempts']})" for row in stats['top_ips']))
+    if stats['top_usernames']:
+        print("Top usernames: " + ", ".join(f"{row['username']} ({row['attempts']})" for row in stats['top_usernames']))
     print("="*80 + "\n")
 
 def main():
@@ -220,11 +244,12 @@ def main():
         print("4. Unban specific IP")
         print("5. Unlock ALL accounts and unban ALL IPs")
         print("6. View recent login attempts")
-        print("7. Show security statistics")
-        print("8. Exit")
+        print("7. Follow login attempts live")
+        print("8. Show security statistics")
+        print("9. Exit")
         print("="*80)
         
-        choice = input("\nSelect option (1-8): ").strip()
+        choice = input("\nSelect option (1-9): ").strip()
         
         if choice == '1':
             list_locked_accounts()
@@ -239,12 +264,34 @@ def main():
         elif choice == '6':
             view_recent_attempts()
         elif choice == '7':
-            show_stats()
+            follow_attempts()
         elif choice == '8':
+            show_stats()
+        elif choice == '9':
             print("\nGoodbye!\n")
             break
         else:
             print("\nInvalid option!\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        # Non-interactive: python security_management.py stats [--hours 24] [--top 10] [--json]
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Security statistics")
+        commands = parser.add_subparsers(dest="command", required=True)
+        stats_parser = commands.add_parser("stats", help="failed attempts and top offenders over a window")
+        stats_parser.add_argument("--hours", type=int, default=24)
+        stats_parser.add_argument("--top", type=int, default=10)
+        stats_parser.add_argument("--json", action="store_true", help="print JSON for monitoring scripts")
+        args = parser.parse_args()
+
+        if not os.path.exists(DB_PATH):
+            print(f"Database not found: {DB_PATH}")
+            sys.exit(1)
+        if args.json:
+            print(json.dumps(get_stats(args.hours, args.top)))
+        else:
+            show_stats(args.hours, args.top)
+    else:
+        main()
\ No newline at end of file
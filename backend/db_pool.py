@@ -0,0 +1,213 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Connection tuning applied once, when a connection is created
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16384
+MMAP_SIZE = 64 * 1024 * 1024
+
+# Callables run as hook(conn, db_path) on every new connection, e.g. tracing
+CONNECT_HOOKS = []
+# sqlite3.Connection subclass used for new connections, e.g. metrics.TimedConnection
+CONNECTION_FACTORY = sqlite3.Connection
+
+
+class PooledConnection:
+    """Thin proxy around a pooled sqlite3 connection; close() hands it back to the pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ("_pool", "_conn"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+    def __del__(self):
+        # Callers that forget close() on an error path still give the slot back
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Pool of read connections plus one serialized writer for a single SQLite file.
+
+    :param db_path: path to the database file
+    :param size: maximum number of read connections kept open
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._probe = None
+        self._probe_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _create(self):
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                               factory=CONNECTION_FACTORY)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        for hook in CONNECT_HOOKS:
+            hook(conn, self.db_path)
+        return conn
+
+    def acquire(self):
+        """Return an idle connection, opening a new one if the pool isn't full yet."""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                self.misses += 1
+                create = True
+            else:
+                self.waits += 1
+                create = False
+
+        if create:
+            try:
+                return self._create()
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=BUSY_TIMEOUT_MS / 1000)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"connection pool for {self.db_path} exhausted")
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work."""
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = None
+        self._idle.put(conn)
+
+    def connect(self) -> PooledConnection:
+        """Drop-in replacement for sqlite3.connect(); call close() to release."""
+        return PooledConnection(self, self.acquire())
+
+    @contextmanager
+    def read(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def write(self):
+        """Serialized writer connection; commits on success and rolls back on error."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._create()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def data_version(self) -> int:
+        """
+        PRAGMA data_version on a dedicated connection that never writes, so the
+        value changes whenever any other connection, in any process, commits.
+        """
+        with self._probe_lock:
+            if self._probe is None:
+                self._probe = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._probe.execute("PRAGMA data_version").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "db": self.db_path,
+                "size": self.size,
+                "open": self._created,
+                "idle": self._idle.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+            }
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._probe_lock:
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
+        with self._lock:
+            self._created = 0
+
+
+# Pools are per process: gunicorn forks workers after import, so a pool
+# inherited from the parent is dropped and rebuilt in the child.
+_pools = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, size=POOL_SIZE) -> ConnectionPool:
+    global _pools_pid
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path, size)
+        return pool
+
+
+def stats() -> list[dict]:
+    """Hit/miss/wait counters for every pool in this worker."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
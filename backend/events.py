@@ -0,0 +1,239 @@
+"""
+Event store for the plain-text logs data/logins.txt and data/calls.txt.
+
+Both logs use the '[ts] EVENT | key=value | ...' format. ingest() parses the
+bytes appended since its last run into the events table, indexed by time,
+user, IP and event, and saves the file's byte offset in the same transaction
+as the rows, so an interrupted run neither loses nor duplicates lines. The
+checkpoint also keeps the file's first line: a log that was rotated or
+truncated no longer starts with it, and is read again from the start.
+
+find() and count() answer questions like "all failures from this IP this
+week" or "link_token_create calls per user" from the indexes.
+
+Usage:
+    python events.py ingest
+    python events.py find [--source logins] [--event FAILED] [--ip IP] [--since ISO] [--until ISO]
+    python events.py count --event link_token_create [--by user_id] [--since ISO]
+"""
+
+import json
+import os
+from datetime import datetime
+
+import db_pool
+import migrations
+import settings
+from call_log import parse_legacy_line
+
+# Lines written per transaction (and checkpoint)
+BATCH_LINES = 5000
+# Bytes of the first line kept to recognise the same file after a restart
+HEAD_BYTES = 256
+GROUP_COLUMNS = ("user_id", "username", "ip", "event", "source")
+
+DB_FILE = settings.current.events_db
+os.makedirs(os.path.dirname(DB_FILE) or ".", exist_ok=True)
+
+
+def sources() -> dict:
+    """Source name -> log path."""
+    return {"logins": settings.current.logins_log, "calls": settings.current.calls_log}
+
+def get_pool():
+    return db_pool.get_pool(DB_FILE, settings.current.pool_size)
+
+def _create_events_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT NOT NULL,
+            source TEXT NOT NULL,
+            event TEXT NOT NULL,
+            user_id TEXT,
+            username TEXT,
+            ip TEXT,
+            fields TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_event_ts ON events (event, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_user_ts ON events (user_id, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_username_ts ON events (username, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ip_ts ON events (ip, ts)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            path TEXT PRIMARY KEY,
+            head BLOB NOT NULL,
+            offset INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+MIGRATIONS = [
+    (1, "events table and ingest checkpoints", _create_events_table),
+]
+
+def migrate():
+    """Bring the events database up to the latest schema version."""
+    return migrations.migrate_schema(get_pool(), MIGRATIONS, "Events")
+
+migrate()
+
+
+def _row(source, line):
+    record = parse_legacy_line(line)
+    if record is None:
+        return None
+    user_id = record.pop("user_id", None)
+    username = record.pop("username", None)
+    ip = record.pop("ip", None) or record.pop("ip_address", None)
+    ts, event = record.pop("ts"), record.pop("event")
+    return (ts, source, event, user_id, username, ip, json.dumps(record) if record else None)
+
+def ingest(source, path=None, pool=None) -> int:
+    """
+    Load the lines appended to a log since the last checkpoint; returns the
+    number of events added. A trailing line without its newline is left for
+    the next run.
+
+    :param source: "logins" or "calls"; stored with every event
+    :param path: log file, defaults to the configured path for source
+    """
+    path = os.path.abspath(path or sources()[source])
+    pool = pool or get_pool()
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    added = 0
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.readline(HEAD_BYTES)
+        with pool.read() as conn:
+            saved = conn.execute("SELECT head, offset FROM ingest_checkpoints WHERE path = ?", (path,)).fetchone()
+        offset = 0
+        if saved and saved[0] == head and saved[1] <= size:
+            offset = saved[1]
+        f.seek(offset)
+        while True:
+            rows = []
+            lines = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                lines += 1
+                row = _row(source, line.decode("utf-8", errors="replace"))
+                if row is not None:
+                    rows.append(row)
+                if lines >= BATCH_LINES:
+                    break
+            if not lines:
+                break
+            with pool.write() as conn:
+                conn.executemany("""
+                    INSERT INTO events (ts, source, event, user_id, username, ip, fields)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+                conn.execute("""
+                    INSERT INTO ingest_checkpoints (path, head, offset, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET head = excluded.head, offset = excluded.offset,
+                        updated_at = excluded.updated_at
+                """, (path, head, offset, datetime.now().isoformat(timespec="seconds")))
+            added += len(rows)
+            # Reading stopped at a partial line or EOF rather than the batch limit
+            if lines < BATCH_LINES:
+                break
+            f.seek(offset)
+    return added
+
+def ingest_all() -> dict:
+    """Ingest every configured log; returns events added per source."""
+    return {source: ingest(source) for source in sources()}
+
+
+def _where(source, event, user_id, username, ip, since, until):
+    clauses, params = [], []
+    for column, value in (("source", source), ("event", event), ("user_id", user_id),
+                          ("username", username), ("ip", ip)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(str(value))
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(since.isoformat())
+    if until is not None:
+        clauses.append("ts < ?")
+        params.append(until.isoformat())
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+def find(source=None, event=None, user_id=None, username=None, ip=None,
+         since=None, until=None, limit=1000) -> list:
+    """
+    Events matching every given filter, oldest first.
+
+    :param since: datetime, inclusive
+    :param until: datetime, exclusive
+    """
+    where, params = _where(source, event, user_id, username, ip, since, until)
+    with get_pool().read() as conn:
+        rows = conn.execute(f"""
+            SELECT ts, source, event, user_id, username, ip, fields FROM events{where}
+            ORDER BY ts LIMIT ?
+        """, params + [limit]).fetchall()
+    return [{"ts": ts, "source": source, "event": event, "user_id": user_id, "username": username, "ip": ip,
+             **(json.loads(fields) if fields else {})}
+            for ts, source, event, user_id, username, ip, fields in rows]
+
+def count(by="user_id", source=None, event=None, user_id=None, username=None, ip=None,
+          since=None, until=None) -> list:
+    """(value, count) of matching events grouped by one of GROUP_COLUMNS, most frequent first."""
+    if by not in GROUP_COLUMNS:
+        raise ValueError(f"by must be one of {', '.join(GROUP_COLUMNS)}")
+    where, params = _where(source, event, user_id, username, ip, since, until)
+    with get_pool().read() as conn:
+        return conn.execute(f"""
+            SELECT {by}, COUNT(*) AS n FROM events{where}
+            GROUP BY {by} ORDER BY n DESC, {by}
+        """, params).fetchall()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def add_filters(command):
+        command.add_argument("--source", choices=sorted(sources()))
+        command.add_argument("--event")
+        command.add_argument("--user", dest="user_id")
+        command.add_argument("--username")
+        command.add_argument("--ip")
+        command.add_argument("--since", type=datetime.fromisoformat, help="ISO time, inclusive")
+        command.add_argument("--until", type=datetime.fromisoformat, help="ISO time, exclusive")
+        command.add_argument("--no-ingest", action="store_true", help="skip ingesting new log lines first")
+
+    parser = argparse.ArgumentParser(description="Event store for logins.txt and calls.txt")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("ingest", help="load newly appended log lines")
+    finder = commands.add_parser("find", help="print matching events as NDJSON")
+    add_filters(finder)
+    finder.add_argument("--limit", type=int, default=1000)
+    counter = commands.add_parser("count", help="count matching events per user, IP, ...")
+    add_filters(counter)
+    counter.add_argument("--by", choices=GROUP_COLUMNS, default="user_id")
+    args = parser.parse_args()
+
+    if args.command == "ingest" or not args.no_ingest:
+        added = ingest_all()
+        if args.command == "ingest":
+            for source, n in added.items():
+                print(f"{source}: {n} new events")
+    if args.command in ("find", "count"):
+        filters = dict(source=args.source, event=args.event, user_id=args.user_id, username=args.username,
+                       ip=args.ip, since=args.since, until=args.until)
+        if args.command == "find":
+            for event in find(**filters, limit=args.limit):
+                print(json.dumps(event))
+        else:
+            for value, n in count(args.by, **filters):
+                print(f"{n:>8}  {value}")
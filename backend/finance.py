@@ -1,55 +1,331 @@
 from datetime import datetime
+import base64
 import sqlite3
 import os
+import threading
+import db_pool
+import settings
+import migrations
+import write_queue
 
-DB_DIR = "data"
-DB_FILE = os.path.join(DB_DIR, "finance.db")
-os.makedirs(DB_DIR, exist_ok=True)
+DB_FILE = settings.current.finance_db
+os.makedirs(os.path.dirname(DB_FILE) or ".", exist_ok=True)
+
+TRANSACTION_COLUMNS = "category, amount, date, title, description, rate, id"
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+# Route inserts, edits and deletes through a group-commit writer thread
+WRITE_QUEUE_ENABLED = settings.current.finance_write_queue
+# Seconds a request waits for its queued write before giving up with TimeoutError
+WRITE_TIMEOUT = 10
+_write_queue = None
+_write_queue_lock = threading.Lock()
 
 def connect_db(db_path=DB_FILE):
-    return sqlite3.connect(db_path)
+    """Borrow a pooled connection; close() returns it to the pool."""
+    return db_pool.get_pool(db_path, settings.current.pool_size).connect()
+
+def get_pool():
+    return db_pool.get_pool(DB_FILE, settings.current.pool_size)
+
+def get_write_queue():
+    """This worker's group-commit writer, created on first use."""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None or _write_queue.pool is not get_pool():
+            _write_queue = write_queue.create(get_pool())
+        return _write_queue
+
+def run_write(op):
+    """
+    Run op(conn) in a write transaction and return its result.
+
+    With WRITE_QUEUE_ENABLED the op joins the group-commit queue and this call
+    blocks until its batch has committed; otherwise it runs synchronously on
+    the pool's writer. Either way a failed op raises its sqlite3.Error here.
+
+    :raises TimeoutError: if the queue hasn't committed the op within
+        WRITE_TIMEOUT; an op that hadn't started yet is cancelled, one already
+        in a batch may still commit
+    """
+    if WRITE_QUEUE_ENABLED:
+        future = get_write_queue().submit(op)
+        try:
+            return future.result(timeout=WRITE_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise
+    with get_pool().write() as conn:
+        return op(conn)
+
+def write_queue_stats():
+    return _write_queue.stats() if _write_queue is not None else None
+
+def _create_transactions_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL,
+            date DATETIME NOT NULL,
+            description TEXT,
+            rate TEXT,
+            title TEXT NOT NULL
+        );
+    """)
+
+def _create_summary_table(conn):
+    """
+    Create transaction_summary, per-user/month/category totals and counts, and
+    the triggers that keep it current. Triggers run inside the writing
+    statement's transaction, so every insert, edit and delete path (including
+    batch inserts) updates the summary atomically.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transaction_summary (
+            user TEXT NOT NULL,
+            month TEXT NOT NULL,
+            category TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user, month, category)
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS transaction_summary_ai AFTER INSERT ON transactions BEGIN
+            INSERT INTO transaction_summary (user, month, category, total, count)
+            VALUES (lower(new.user), substr(new.date, 1, 7), new.category, new.amount, 1)
+            ON CONFLICT (user, month, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS transaction_summary_ad AFTER DELETE ON transactions BEGIN
+            UPDATE transaction_summary SET total = total - old.amount, count = count - 1
+            WHERE user = lower(old.user) AND month = substr(old.date, 1, 7) AND category = old.category;
+            DELETE FROM transaction_summary
+            WHERE user = lower(old.user) AND month = substr(old.date, 1, 7) AND category = old.category AND count <= 0;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS transaction_summary_au AFTER UPDATE OF user, category, amount, date ON transactions BEGIN
+            UPDATE transaction_summary SET total = total - old.amount, count = count - 1
+            WHERE user = lower(old.user) AND month = substr(old.date, 1, 7) AND category = old.category;
+            DELETE FROM transaction_summary
+            WHERE user = lower(old.user) AND month = substr(old.date, 1, 7) AND category = old.category AND count <= 0;
+            INSERT INTO transaction_summary (user, month, category, total, count)
+            VALUES (lower(new.user), substr(new.date, 1, 7), new.category, new.amount, 1)
+            ON CONFLICT (user, month, category) DO UPDATE SET
+                total = total + excluded.total,
+                count = count + 1;
+        END
+    """)
+    rebuild_summary(conn)
+
+def _index_transactions_by_user(conn):
+    # Serves WHERE user = ? COLLATE NOCASE ... ORDER BY date, id without a sort
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user COLLATE NOCASE, date, id)")
+
+def _create_user_versions(conn):
+    """
+    Per-user counter bumped by triggers on every insert, edit and delete, so
+    readers can tell whether a user's transactions changed without reading them.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for name, event, users in (
+        ("user_versions_ai", "INSERT", ["new.user"]),
+        ("user_versions_ad", "DELETE", ["old.user"]),
+        ("user_versions_au", "UPDATE", ["old.user", "new.user"]),
+    ):
+        bumps = "".join(f"""
+            INSERT INTO user_versions (user, version) VALUES (lower({user}), 1)
+            ON CONFLICT (user) DO UPDATE SET version = version + 1;""" for user in users)
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON transactions BEGIN {bumps} END")
+
+def _add_content_hash(conn):
+    """Statement imports store a per-row hash; the partial unique index makes re-imports skip known rows."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+    if "content_hash" not in columns:
+        conn.execute("ALTER TABLE transactions ADD COLUMN content_hash TEXT")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_content_hash ON transactions (content_hash)
+        WHERE content_hash IS NOT NULL
+    """)
+
+MIGRATIONS = [
+    (1, "create transactions table", _create_transactions_table),
+    (2, "transaction summary table and triggers", _create_summary_table),
+    (3, "index transactions by user and date", _index_transactions_by_user),
+    (4, "per-user version counters", _create_user_versions),
+    (5, "content hash for deduplicated imports", _add_content_hash),
+]
+
+def migrate():
+    """Bring finance.db up to the latest schema version."""
+    return migrations.migrate_schema(get_pool(), MIGRATIONS, "Finance")
+
+def rebuild_summary(conn):
+    """Recompute transaction_summary from scratch."""
+    conn.execute("DELETE FROM transaction_summary")
+    conn.execute("""
+        INSERT INTO transaction_summary (user, month, category, total, count)
+        SELECT lower(user), substr(date, 1, 7), category, SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY lower(user), substr(date, 1, 7), category
+    """)
+
+def get_summary(user, start_month=None, end_month=None):
+    """
+    Monthly per-category totals for a user, read from transaction_summary.
+
+    :param user: str (case-insensitive)
+    :param start_month: "YYYY-MM" or None
+    :param end_month: "YYYY-MM" or None, inclusive
+    :return: list of {"month", "category", "total", "count"} ordered by month
+    """
+    sql = "SELECT month, category, total, count FROM transaction_summary WHERE user = lower(?)"
+    args = [user]
+    if start_month:
+        sql += " AND month >= ?"
+        args.append(start_month)
+    if end_month:
+        sql += " AND month <= ?"
+        args.append(end_month)
+    sql += " ORDER BY month, category"
 
-def create_table():
-    """Create the transactions table if it doesn't exist."""
-    conn = connect_db()
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user TEXT NOT NULL,
-                category TEXT NOT NULL,
-                amount REAL NOT NULL,
-                date DATETIME NOT NULL,
-                description TEXT,
-                rate TEXT,
-                title TEXT NOT NULL
-            );
-        """)
-        conn.commit()
-        print("Transactions table is ready.")
+        with get_pool().read() as conn:
+            rows = conn.execute(sql, args).fetchall()
     except sqlite3.Error as e:
-        print(f"Error creating table: {e}")
-    finally:
-        conn.close()
+        print(f"Error retrieving summary: {e}")
+        return []
+    return [
+        {"month": month, "category": category, "total": round(total, 2), "count": count}
+        for month, category, total, count in rows
+    ]
 
 
 def get_transactions_by_user(user):
     """Retrieve all transactions for a specific user (case-insensitive)."""
-    conn = connect_db()
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT category, amount, date, title, description, rate, id FROM transactions WHERE user = ? COLLATE NOCASE",
-            (user,)
-        )
-        transactions = cursor.fetchall()
-        return transactions
+        with get_pool().read() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT category, amount, date, title, description, rate, id FROM transactions WHERE user = ? COLLATE NOCASE",
+                (user,)
+            )
+            transactions = cursor.fetchall()
+            return transactions
     except sqlite3.Error as e:
         print(f"Error retrieving transactions: {e}")
         return []
-    finally:
-        conn.close()
+
+def get_user_version(user) -> int:
+    """Current change counter for a user's transactions (0 if they have never had any)."""
+    try:
+        with get_pool().read() as conn:
+            row = conn.execute("SELECT version FROM user_versions WHERE user = lower(?)", (user,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Error retrieving user version: {e}")
+        return -1
+    return row[0] if row else 0
+
+def transaction_to_dict(row):
+    """Map a TRANSACTION_COLUMNS row to the JSON shape the frontend uses."""
+    return {
+        "category": row[0],
+        "amount": row[1],
+        "date": row[2],
+        "title": row[3],
+        "description": row[4],
+        "rate": row[5],
+        "id": row[6]
+    }
+
+def encode_cursor(date, transaction_id):
+    return base64.urlsafe_b64encode(f"{date}|{transaction_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    """Return (date, id) from a page cursor; raises ValueError if it is malformed."""
+    try:
+        date, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return date, int(transaction_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_transactions_page(user, limit=PAGE_SIZE, cursor=None):
+    """
+    Retrieve one page of a user's transactions, newest first, keyed on (date, id).
+
+    :param user: str
+    :param limit: int, clamped to MAX_PAGE_SIZE
+    :param cursor: str or None, the next_cursor of the previous page
+    :return: (rows, next_cursor); next_cursor is None on the last page
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    sql = f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE user = ? COLLATE NOCASE"
+    args = [user]
+    if cursor:
+        sql += " AND (date, id) < (?, ?)"
+        args.extend(decode_cursor(cursor))
+    sql += " ORDER BY date DESC, id DESC LIMIT ?"
+    # One extra row tells us whether there is another page
+    args.append(limit + 1)
+
+    try:
+        with get_pool().read() as conn:
+            rows = conn.execute(sql, args).fetchall()
+    except sqlite3.Error as e:
+        print(f"Error retrieving transactions: {e}")
+        return [], None
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][2], rows[-1][6])
+
+def iter_transactions_by_user(user, batch_size=STREAM_BATCH_SIZE, start=None, end=None, categories=None):
+    """
+    Yield a user's transactions newest first, fetching batch_size rows at a time.
+
+    The pooled connection is held until the generator is exhausted or closed.
+
+    :param start: "YYYY-MM-DD" or None, inclusive
+    :param end: "YYYY-MM-DD" or None, inclusive
+    :param categories: list of categories to keep, or None for all
+    """
+    sql = f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE user = ? COLLATE NOCASE"
+    args = [user]
+    # Dates are stored as "YYYY-MM-DD HH:MM:SS", so both bounds stay on idx_transactions_user_date
+    if start:
+        sql += " AND date >= ?"
+        args.append(start)
+    if end:
+        sql += " AND date < date(?, '+1 day')"
+        args.append(end)
+    if categories:
+        sql += f" AND category IN ({', '.join('?' * len(categories))})"
+        args.extend(categories)
+    sql += " ORDER BY date DESC, id DESC"
+    with get_pool().read() as conn:
+        cursor = conn.execute(sql, args)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
 
 def insert_transaction(user, category, amount, date_obj, title, description, rate, logger=None):
     """
@@ -67,14 +343,12 @@ def insert_transaction(user, category, amount, date_obj, title, description, rat
     if not isinstance(date_obj, datetime):
         raise TypeError("date_obj must be a datetime object")
 
-    conn = connect_db()
+    row = (user, category, amount, date_obj.strftime("%Y-%m-%d %H:%M:%S"), title, description, rate)
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
+        run_write(lambda conn: conn.execute("""
             INSERT INTO transactions (user, category, amount, date, title, description, rate)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (user, category, amount, date_obj.strftime("%Y-%m-%d %H:%M:%S"), title, description, rate))
-        conn.commit()
+        """, row))
         if logger:
             logger.info(f"Inserted transaction: {user}, {category}, {amount}, {date_obj}, {title}, {description}, {rate}")
         return True
@@ -82,8 +356,68 @@ def insert_transaction(user, category, amount, date_obj, title, description, rat
         if logger:
             logger.error(f"Error inserting transaction: {e}")
         return False
-    finally:
-        conn.close()
+
+def insert_transactions(transactions, logger=None):
+    """
+    Insert many transactions with one executemany in a single database transaction.
+
+    :param transactions: iterable of dicts with the insert_transaction keyword arguments
+    :param logger: logging.Logger or None
+    :return: number of rows inserted, or None if the batch was rolled back
+    """
+    rows = []
+    for t in transactions:
+        if not isinstance(t["date_obj"], datetime):
+            raise TypeError("date_obj must be a datetime object")
+        rows.append((t["user"], t["category"], t["amount"], t["date_obj"].strftime("%Y-%m-%d %H:%M:%S"),
+                     t["title"], t.get("description"), t.get("rate")))
+
+    try:
+        run_write(lambda conn: conn.executemany("""
+            INSERT INTO transactions (user, category, amount, date, title, description, rate)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows))
+        if logger:
+            logger.info(f"Inserted {len(rows)} transactions")
+        return len(rows)
+    except sqlite3.Error as e:
+        if logger:
+            logger.error(f"Error inserting transactions: {e}")
+        return None
+
+def insert_unique_transactions(transactions, logger=None):
+    """
+    Insert transactions carrying a content_hash in one database transaction,
+    skipping any whose hash is already stored.
+
+    :param transactions: iterable of dicts with the insert_transaction keyword arguments plus content_hash
+    :param logger: logging.Logger or None
+    :return: (inserted, duplicates), or None if the batch was rolled back
+    """
+    rows = []
+    for t in transactions:
+        if not isinstance(t["date_obj"], datetime):
+            raise TypeError("date_obj must be a datetime object")
+        rows.append((t["user"], t["category"], t["amount"], t["date_obj"].strftime("%Y-%m-%d %H:%M:%S"),
+                     t["title"], t.get("description"), t.get("rate"), t["content_hash"]))
+
+    def insert(conn):
+        cursor = conn.executemany("""
+            INSERT INTO transactions (user, category, amount, date, title, description, rate, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (content_hash) WHERE content_hash IS NOT NULL DO NOTHING
+        """, rows)
+        return cursor.rowcount
+
+    try:
+        inserted = run_write(insert)
+    except sqlite3.Error as e:
+        if logger:
+            logger.error(f"Error inserting transactions: {e}")
+        return None
+    if logger:
+        logger.info(f"Inserted {inserted} transactions, skipped {len(rows) - inserted} duplicates")
+    return inserted, len(rows) - inserted
 
 def edit_transaction_by_id(transaction_id, category=None, amount=None, date_obj=None, title=None, description=None, rate=None, logger=None):
     """
@@ -99,38 +433,35 @@ def edit_transaction_by_id(transaction_id, category=None, amount=None, date_obj=
     :param logger: optional logging object
     :return: True if updated, False if not found or error
     """
-    conn = connect_db()
+    fields = []
+    values = []
+
+    if category is not None:
+        fields.append("category = ?")
+        values.append(category)
+    if amount is not None:
+        fields.append("amount = ?")
+        values.append(amount)
+    if date_obj is not None:
+        if not isinstance(date_obj, datetime):
+            raise TypeError("date_obj must be a datetime object")
+        fields.append("date = ?")
+        values.append(date_obj.strftime("%Y-%m-%d %H:%M:%S"))
+    if title is not None:
+        fields.append("title = ?")
+        values.append(title)
+    if description is not None:
+        fields.append("description = ?")
+        values.append(description)
+    if rate is not None:
+        fields.append("rate = ?")
+        values.append(rate)
+
+    values.append(transaction_id)
+    sql = f"UPDATE transactions SET {', '.join(fields)} WHERE id = ?"
     try:
-        cursor = conn.cursor()
-        fields = []
-        values = []
-
-        if category is not None:
-            fields.append("category = ?")
-            values.append(category)
-        if amount is not None:
-            fields.append("amount = ?")
-            values.append(amount)
-        if date_obj is not None:
-            if not isinstance(date_obj, datetime):
-                raise TypeError("date_obj must be a datetime object")
-            fields.append("date = ?")
-            values.append(date_obj.strftime("%Y-%m-%d %H:%M:%S"))
-        if title is not None:
-            fields.append("title = ?")
-            values.append(title)
-        if description is not None:
-            fields.append("description = ?")
-            values.append(description)
-        if rate is not None:
-            fields.append("rate = ?")
-            values.append(rate)
-
-        values.append(transaction_id)
-        sql = f"UPDATE transactions SET {', '.join(fields)} WHERE id = ?"
-        cursor.execute(sql, tuple(values))
-        conn.commit()
-        if cursor.rowcount == 0:
+        rowcount = run_write(lambda conn: conn.execute(sql, tuple(values)).rowcount)
+        if rowcount == 0:
             if logger:
                 logger.warning(f"No transaction found with id {transaction_id}")
             return False
@@ -141,8 +472,6 @@ def edit_transaction_by_id(transaction_id, category=None, amount=None, date_obj=
         if logger:
             logger.error(f"Error updating transaction {transaction_id}: {e}")
         return False
-    finally:
-        conn.close()
 
 def delete_transaction_by_id(transaction_id, logger=None):
     """
@@ -152,12 +481,9 @@ def delete_transaction_by_id(transaction_id, logger=None):
     :param logger: optional logging object
     :return: True if deleted, False if not found or error
     """
-    conn = connect_db()
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
-        conn.commit()
-        if cursor.rowcount == 0:
+        rowcount = run_write(lambda conn: conn.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,)).rowcount)
+        if rowcount == 0:
             if logger:
                 logger.warning(f"No transaction found with id {transaction_id}")
             return False
@@ -168,8 +494,21 @@ def delete_transaction_by_id(transaction_id, logger=None):
         if logger:
             logger.error(f"Error deleting transaction {transaction_id}: {e}")
         return False
-    finally:
-        conn.close()
 
-# Initialize the table when this module is imported
-create_table()
\ No newline at end of file
+# Bring the schema up to date when this module is imported
+migrate()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Finance database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild-summary", help="recompute transaction_summary from the transactions table")
+    args = parser.parse_args()
+
+    if args.command == "rebuild-summary":
+        with get_pool().write() as conn:
+            rebuild_summary(conn)
+            count = conn.execute("SELECT COUNT(*) FROM transaction_summary").fetchone()[0]
+        print(f"transaction_summary rebuilt with {count} rows.")
@@ -1,12 +1,77 @@
+import json
 import os
-import sqlite3
+import db_pool
+import settings
+import migrations
 
-DB_DIR = "data"
-DB_FILE = os.path.join(DB_DIR, "lego_db.db")
-os.makedirs(DB_DIR, exist_ok=True)
+DB_FILE = settings.current.lego_db
+os.makedirs(os.path.dirname(DB_FILE) or ".", exist_ok=True)
+
+# Largest page a caller can ask for, so a one-letter term can't page through the whole catalog at once
+MAX_SEARCH_LIMIT = 500
+MAX_LOOKUP_PARTS = 2000
 
 def connect_db(db_path=DB_FILE):
-    return sqlite3.connect(db_path)
+    """Borrow a pooled connection; close() returns it to the pool."""
+    return db_pool.get_pool(db_path, settings.current.pool_size).connect()
+
+def get_pool():
+    return db_pool.get_pool(DB_FILE, settings.current.pool_size)
+
+def _index_container_lookups(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_containerpiece_part_number ON ContainerPiece (part_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_containerpiece_container_id ON ContainerPiece (container_id)")
+    # Also serves lookups on box_id alone, so no separate box_id index
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_container_box_position ON Container (box_id, position_id)")
+
+# Full-text search index
+def create_search_index(conn):
+    """
+    (Re)create the PieceSearch FTS5 table from the current catalog, plus the
+    triggers that keep it in sync with Piece.
+
+    PieceSearch stores its own copy of part_number, name and category and is
+    keyed by part_number rather than by Piece's rowid: Piece's primary key is
+    TEXT, so its implicit rowid can change on VACUUM. Runs in the caller's
+    transaction, for migrations (no executescript).
+    """
+    for trigger in ("piece_search_ai", "piece_search_ad", "piece_search_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS PieceSearch")
+    conn.execute("""
+        CREATE VIRTUAL TABLE PieceSearch USING fts5(
+            part_number UNINDEXED, name, category, tokenize='trigram'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER piece_search_ai AFTER INSERT ON Piece BEGIN
+            INSERT INTO PieceSearch (part_number, name, category)
+            VALUES (new.part_number, new.name, new.category);
+        END
+    """)
+    # part_number is unindexed, so these deletes read the whole index; the catalog rarely changes
+    conn.execute("""
+        CREATE TRIGGER piece_search_ad AFTER DELETE ON Piece BEGIN
+            DELETE FROM PieceSearch WHERE part_number = old.part_number;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER piece_search_au AFTER UPDATE ON Piece BEGIN
+            DELETE FROM PieceSearch WHERE part_number = old.part_number;
+            INSERT INTO PieceSearch (part_number, name, category)
+            VALUES (new.part_number, new.name, new.category);
+        END
+    """)
+    conn.execute("INSERT INTO PieceSearch (part_number, name, category) SELECT part_number, name, category FROM Piece")
+
+MIGRATIONS = [
+    (1, "index container and piece lookups", _index_container_lookups),
+    (2, "PieceSearch full-text index keyed by part number", create_search_index),
+]
+
+def migrate():
+    """Bring lego_db.db up to the latest schema version."""
+    return migrations.migrate_schema(get_pool(), MIGRATIONS, "Lego")
 
 def normalize_container_id(cid):
     """Ensure container ID is in the format cXXX"""
@@ -76,6 +141,121 @@ def get_contents_of_box(conn, box_id):
     """, (box_id,))
     return cur.fetchall()
 
+def get_inventory(conn) -> dict:
+    """
+    Every box, container, position and piece from a single query, in a compact
+    columnar layout: parallel arrays per entity, with names, categories and
+    positions stored once in string tables and referenced by index.
+
+        boxes:      [box_id, ...]
+        strings:    {"names": [...], "categories": [...], "positions": [...]}
+        containers: {"id": [...], "box": [boxes index], "position": [positions index]}
+        pieces:     {"part_number": [...], "name": [names index], "category": [categories index]}
+        contents:   {"container": [containers index], "piece": [pieces index]}
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT b.id, c.id, c.position_id, p.part_number, p.name, p.category
+        FROM Box b
+        LEFT JOIN Container c ON c.box_id = b.id
+        LEFT JOIN ContainerPiece cp ON cp.container_id = c.id
+        LEFT JOIN Piece p ON p.part_number = cp.part_number
+        ORDER BY b.id, c.position_id, c.id, p.part_number
+    """)
+
+    def interner(table):
+        index = {}
+        def intern(value):
+            if value not in index:
+                index[value] = len(table)
+                table.append(value)
+            return index[value]
+        return intern
+
+    boxes, names, categories, positions = [], [], [], []
+    containers = {"id": [], "box": [], "position": []}
+    pieces = {"part_number": [], "name": [], "category": []}
+    contents = {"container": [], "piece": []}
+    box_index, name_index, category_index, position_index = (
+        interner(boxes), interner(names), interner(categories), interner(positions))
+    container_index = {}
+    piece_index = {}
+
+    for box_id, container_id, position_id, part_number, name, category in cur:
+        b = box_index(box_id)
+        if container_id is None:
+            continue
+        c = container_index.get(container_id)
+        if c is None:
+            c = container_index[container_id] = len(containers["id"])
+            containers["id"].append(container_id)
+            containers["box"].append(b)
+            containers["position"].append(position_index(position_id))
+        if part_number is None:
+            continue
+        p = piece_index.get(part_number)
+        if p is None:
+            p = piece_index[part_number] = len(pieces["part_number"])
+            pieces["part_number"].append(part_number)
+            pieces["name"].append(name_index(name))
+            pieces["category"].append(category_index(category))
+        contents["container"].append(c)
+        contents["piece"].append(p)
+
+    return {
+        "boxes": boxes,
+        "strings": {"names": names, "categories": categories, "positions": positions},
+        "containers": containers,
+        "pieces": pieces,
+        "contents": contents
+    }
+
+def locate_pieces(conn, part_numbers) -> dict:
+    """
+    Resolve a build list of part numbers to storage locations in one query.
+
+    The list is passed as a single JSON parameter and joined through
+    json_each, so it costs one statement however many parts are asked for.
+    Locations come back grouped by container in pick order (box, then
+    position); part numbers not in the catalog are reported as missing, and
+    catalog parts with no container as unstored.
+    """
+    wanted = list(dict.fromkeys(str(pn) for pn in part_numbers))
+    cur = conn.cursor()
+    cur.execute("""
+        WITH wanted(part_number) AS (SELECT value FROM json_each(?))
+        SELECT w.part_number, p.part_number IS NOT NULL, p.name, p.category, c.id, c.box_id, c.position_id
+        FROM wanted w
+        LEFT JOIN Piece p ON p.part_number = w.part_number
+        LEFT JOIN ContainerPiece cp ON cp.part_number = w.part_number
+        LEFT JOIN Container c ON c.id = cp.container_id
+        ORDER BY c.box_id, c.position_id, c.id, w.part_number
+    """, (json.dumps(wanted),))
+
+    locations = {}
+    missing = []
+    unstored = []
+    for part_number, in_catalog, name, category, container_id, box, position in cur:
+        if container_id is None:
+            (unstored if in_catalog else missing).append(part_number)
+            continue
+        location = locations.get(container_id)
+        if location is None:
+            location = locations[container_id] = {
+                "box": box,
+                "position": position,
+                "container_id": container_id,
+                "location": f"{box}{position.lower()}" if box and position else None,
+                "pieces": []
+            }
+        location["pieces"].append({"part_number": part_number, "name": name, "category": category})
+
+    return {
+        "locations": list(locations.values()),
+        "missing": missing,
+        "unstored": unstored
+    }
+
 # Piece operations
 def get_pieces_in_container(conn, container_id) -> list[dict]:
     """Return a list of pieces in the given container, each as a dictionary."""
@@ -119,43 +299,89 @@ def get_piece(conn, part_number) -> dict[str, str] | None:
         return None
     return {"part_number": row[0], "name": row[1], "category": row[2]}
 
-def search_piece(conn, part_number=None, name=None, category=None) -> list[dict]:
-    """Search for a piece in the catalog and return list of results"""
+def has_search_index(conn) -> bool:
     cur = conn.cursor()
-    part_nums = []
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'PieceSearch'")
+    return cur.fetchone() is not None
+
+def search_piece(conn, part_number=None, name=None, category=None, limit=None, offset=0) -> list[dict]:
+    """
+    Search for a piece in the catalog and return list of results.
+
+    Pieces, their containers and each container's box/position come back from
+    one joined query and are grouped here. limit/offset page over pieces;
+    without a limit every match is returned, as before paging existed.
+    Name and category searches go through the PieceSearch index, ranked by
+    bm25, when it exists (migration 2 builds it).
+    """
+    # SQLite reads a negative LIMIT as no limit
+    limit = -1 if limit is None else max(1, min(int(limit), MAX_SEARCH_LIMIT))
+    offset = max(0, int(offset))
 
     if part_number:
-        part_nums = [part_number]
-    elif name:
-        cur.execute("SELECT part_number FROM Piece WHERE name LIKE ?", ('%' + name + '%',))
-        part_nums = [row[0] for row in cur.fetchall()]
-    elif category:
-        cur.execute("SELECT part_number FROM Piece WHERE category LIKE ?", ('%' + category + '%',))
-        part_nums = [row[0] for row in cur.fetchall()]
-
-    results = []
-
-    for pn in part_nums:
-        cur.execute("SELECT name, category FROM Piece WHERE part_number = ?", (pn,))
-        piece = cur.fetchone()
-        if not piece:
-            continue
+        pieces_sql = "SELECT part_number, name, category, 0 AS score FROM Piece WHERE part_number = ? ORDER BY part_number"
+        args = [str(part_number)]
+    else:
+        column, term = ("name", name) if name else ("category", category)
+        if not term:
+            return []
+        if len(term) >= 3 and has_search_index(conn):
+            pieces_sql = """
+                SELECT part_number, name, category, rank AS score
+                FROM PieceSearch
+                WHERE PieceSearch MATCH ?
+                ORDER BY rank, part_number
+            """
+            args = [f'{column} : "{term.replace(chr(34), chr(34) * 2)}"']
+        else:
+            # Trigram tokens need at least 3 characters; shorter terms scan
+            pieces_sql = f"SELECT part_number, name, category, 0 AS score FROM Piece WHERE {column} LIKE ? ORDER BY part_number"
+            args = ['%' + term + '%']
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT p.part_number, p.name, p.category, cp.container_id, c.box_id, c.position_id
+        FROM (
+            {pieces_sql}
+            LIMIT ? OFFSET ?
+        ) p
+        LEFT JOIN ContainerPiece cp ON cp.part_number = p.part_number
+        LEFT JOIN Container c ON c.id = cp.container_id
+        ORDER BY p.score, p.part_number, cp.container_id
+    """, (*args, limit, offset))
 
-        piece_name, piece_category = piece
-        containers = get_containers_with_piece(conn, pn)
-        container_info = []
-        for cid in containers:
-            location = get_containers_location(conn, cid)
-            container_info.append({
+    results = {}
+    for pn, piece_name, piece_category, cid, box, position in cur:
+        piece = results.get(pn)
+        if piece is None:
+            piece = results[pn] = {
+                "part_number": pn,
+                "name": piece_name,
+                "category": piece_category,
+                "containers": []
+            }
+        if cid is not None:
+            piece["containers"].append({
                 "container_id": cid,
-                "location": f"{location[0]}{location[1].lower()}" if location and location[0] and location[1] else None
+                "location": f"{box}{position.lower()}" if box and position else None
             })
 
-        results.append({
-            "part_number": pn,
-            "name": piece_name,
-            "category": piece_category,
-            "containers": container_info
-        })
+    return list(results.values())
+
+# Bring the schema up to date when this module is imported
+migrate()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lego database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build-search-index", help="rebuild the PieceSearch full-text index from Piece")
+    args = parser.parse_args()
 
-    return results
\ No newline at end of file
+    if args.command == "build-search-index":
+        with get_pool().write() as conn:
+            create_search_index(conn)
+            count = conn.execute("SELECT COUNT(*) FROM Piece").fetchone()[0]
+        print(f"PieceSearch index rebuilt for {count} pieces.")
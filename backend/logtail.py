@@ -0,0 +1,93 @@
+"""
+Tail and follow append-only text logs such as data/logins.txt and data/calls.txt.
+
+tail_lines() seeks backwards from EOF in fixed-size blocks, so its cost depends
+on how many lines are asked for, not on how large the log has grown.
+"""
+
+import os
+import time
+
+BLOCK_SIZE = 8192
+
+def tail_lines(path, n=20, block_size=BLOCK_SIZE):
+    """
+    Yield the last n lines of a file, oldest first, without their newlines.
+
+    :param path: path to the log file
+    :param n: number of lines
+    :param block_size: bytes read per backwards seek
+    """
+    if n <= 0:
+        return
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        blocks = []
+        newlines = 0
+        # n lines need n separators plus the trailing newline of the last line
+        while position > 0 and newlines <= n:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size)
+            blocks.append(block)
+            newlines += block.count(b"\n")
+
+    if not blocks:
+        return
+    data = b"".join(reversed(blocks))
+    if data.endswith(b"\n"):
+        data = data[:-1]
+    for line in data.split(b"\n")[-n:]:
+        yield line.decode("utf-8", errors="replace")
+
+def follow(path, poll_interval=0.5, from_end=True):
+    """
+    Yield lines as they are appended to a file, like `tail -f`.
+
+    Reopens the file if it is truncated or replaced (rotation). Runs until the
+    caller stops iterating.
+
+    :param path: path to the log file
+    :param poll_interval: seconds to sleep when no new data is available
+    :param from_end: start at the current end of file instead of the beginning
+    """
+    f = None
+    inode = None
+    partial = b""
+    try:
+        while True:
+            if f is None:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    time.sleep(poll_interval)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                if from_end:
+                    f.seek(0, os.SEEK_END)
+                from_end = False
+
+            chunk = f.readline()
+            if chunk:
+                partial += chunk
+                if partial.endswith(b"\n"):
+                    yield partial.rstrip(b"\n").decode("utf-8", errors="replace")
+                    partial = b""
+                continue
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is None or stat.st_ino != inode or stat.st_size < f.tell():
+                # Rotated or truncated: start over on the new file
+                f.close()
+                f = None
+                partial = b""
+                continue
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
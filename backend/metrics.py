@@ -0,0 +1,408 @@
+"""
+Request and SQL latency metrics in the Prometheus text format.
+
+Each process keeps its own histograms in memory:
+  * http_request_duration_seconds{route, method, status}, from Flask request hooks
+  * sqlite_query_duration_seconds{db, statement}, timed by TimedConnection,
+    the sqlite3 connection factory db_pool uses once install_sql_timing() runs
+
+A background thread writes every worker's state to <metrics_dir>/worker-<pid>.json.
+/metrics merges all those files, so a scrape answered by any gunicorn worker
+reports the whole server. Histograms from workers that have exited are folded
+into dead.json and still counted, so totals never go backwards. Gauges (pool,
+cache and write queue stats) come from registered collectors and are reported
+per live worker with a pid label.
+"""
+
+import fcntl
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from flask import Response, g, request
+
+import settings
+from background import BackgroundThread
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("HTTP request latency by route, method and status", HTTP_BUCKETS),
+    "sqlite_query_duration_seconds": ("SQLite statement latency, including row fetches, by normalized SQL", SQL_BUCKETS),
+}
+FLUSH_INTERVAL = 2.0
+# Distinct statements tracked per process; anything beyond is counted as "other"
+MAX_STATEMENTS = 500
+DEAD_NAME = "dead.json"
+
+# Reentrant: a TimedCursor collected mid-observe() records from inside the lock
+_lock = threading.RLock()
+_histograms = {name: {} for name in HISTOGRAMS}
+_collectors = []
+_flusher_pid = None
+_dirty = False
+
+
+def observe(name, labels, seconds):
+    """Add one observation to a histogram; labels is a dict of strings."""
+    global _dirty
+    buckets = HISTOGRAMS[name][1]
+    key = json.dumps(sorted(labels.items()))
+    _flusher.ensure()
+    with _lock:
+        series = _histograms[name].get(key)
+        if series is None:
+            # One count per bucket, then sum and count
+            series = _histograms[name][key] = [0] * len(buckets) + [0.0, 0]
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                series[i] += 1
+                break
+        series[-2] += seconds
+        series[-1] += 1
+        _dirty = True
+
+
+def register_collector(collect):
+    """
+    Add a gauge source, called at every flush. collect() returns
+    (name, help, labels dict, value) tuples.
+    """
+    _collectors.append(collect)
+
+
+# ---------------------------------------------- SQL timing -------------------------------------------------
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_statements = set()
+# Per-thread list that, while set, also receives (statement, seconds) for each statement
+_captured = threading.local()
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql) -> str:
+    """Collapse whitespace and literals so one query shape is one label."""
+    sql = " ".join(sql.split())
+    sql = _LITERALS.sub("?", sql)
+    sql = _IN_LISTS.sub("(?, ...)", sql)
+    return sql
+
+def _statement_label(sql) -> str:
+    statement = normalize_sql(sql)
+    if statement not in _statements:
+        if len(_statements) >= MAX_STATEMENTS:
+            return "other"
+        _statements.add(statement)
+    return statement
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor that times each statement from execute() until its rows are
+    exhausted, the cursor is reused or closed, or it is garbage collected.
+    """
+
+    _pending = None
+
+    def _start(self, sql):
+        self._finish()
+        self._pending = [_statement_label(sql), 0.0]
+
+    def _add(self, elapsed, done):
+        if self._pending is not None:
+            self._pending[1] += elapsed
+            if done:
+                self._finish()
+
+    def _finish(self):
+        if self._pending is not None:
+            statement, elapsed = self._pending
+            self._pending = None
+            db = os.path.basename(getattr(self.connection, "db_path", "") or "")
+            observe("sqlite_query_duration_seconds", {"db": db, "statement": statement}, elapsed)
+            captured = getattr(_captured, "statements", None)
+            if captured is not None:
+                captured.append((db, statement, elapsed))
+
+    def execute(self, sql, parameters=()):
+        self._start(sql)
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._add(time.perf_counter() - start, self.description is None)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql)
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(time.perf_counter() - start, True)
+        return self
+
+    def executescript(self, script):
+        self._start("<script>")
+        start = time.perf_counter()
+        try:
+            super().executescript(script)
+        finally:
+            self._add(time.perf_counter() - start, True)
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add(time.perf_counter() - start, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add(time.perf_counter() - start, not rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add(time.perf_counter() - start, True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(time.perf_counter() - start, True)
+            raise
+        self._add(time.perf_counter() - start, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors, including conn.execute() shortcuts, are TimedCursors."""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.db_path = database
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+def start_capture():
+    """Also collect this thread's statements until stop_capture(), e.g. for a profiled request."""
+    _captured.statements = []
+
+def stop_capture() -> list:
+    """(db, statement, seconds) for each statement since start_capture()."""
+    statements = getattr(_captured, "statements", None) or []
+    _captured.statements = None
+    return statements
+
+
+def install_sql_timing():
+    """Time statements on every pooled connection opened from now on."""
+    import db_pool
+    db_pool.CONNECTION_FACTORY = TimedConnection
+
+
+# ---------------------------------------------- Flask hooks -------------------------------------------------
+
+def init_app(app, path="/metrics"):
+    """Time every request and serve the merged metrics at path."""
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule(path, "metrics", metrics_view)
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+def _record_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        labels = {"route": route, "method": request.method, "status": str(response.status_code)}
+        observe("http_request_duration_seconds", labels, time.perf_counter() - start)
+    return response
+
+def metrics_view():
+    """Needs the METRICS_TOKEN bearer; with no token configured the endpoint stays closed."""
+    if not settings.check_metrics_token(request.headers.get("Authorization")):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    flush()
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+# ---------------------------------------------- cross-worker files -------------------------------------------------
+
+def _worker_path(pid) -> str:
+    return os.path.join(settings.current.metrics_dir, f"worker-{pid}.json")
+
+def _locked():
+    os.makedirs(settings.current.metrics_dir, exist_ok=True)
+    lock = open(os.path.join(settings.current.metrics_dir, ".lock"), "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _read_json(path) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _merge(into, histograms):
+    for name, series in histograms.items():
+        target = into.setdefault(name, {})
+        for key, values in series.items():
+            if key in target:
+                target[key] = [a + b for a, b in zip(target[key], values)]
+            else:
+                target[key] = list(values)
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _collect_gauges() -> list:
+    gauges = []
+    for collect in _collectors:
+        try:
+            gauges.extend([name, help_text, labels, value] for name, help_text, labels, value in collect())
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+    return gauges
+
+def _fold_dead(pid, data):
+    """Add an exited worker's histograms to dead.json and remove its file; call with the lock held."""
+    dead_path = os.path.join(settings.current.metrics_dir, DEAD_NAME)
+    dead = _read_json(dead_path) or {}
+    _merge(dead, data.get("histograms", {}))
+    _write_json(dead_path, dead)
+    os.remove(_worker_path(pid))
+
+def flush():
+    """Write this worker's histograms and gauges to its file."""
+    global _dirty, _flusher_pid
+    pid = os.getpid()
+    with _lock:
+        histograms = {name: dict(series) for name, series in _histograms.items()}
+        _dirty = False
+    data = {"pid": pid, "histograms": histograms, "gauges": _collect_gauges()}
+    with _locked():
+        path = _worker_path(pid)
+        if _flusher_pid != pid:
+            # A file under our pid was left by an earlier process that had it
+            stale = _read_json(path)
+            if stale is not None:
+                _fold_dead(pid, stale)
+            _flusher_pid = pid
+        _write_json(path, data)
+
+def _clear_inherited():
+    # Histograms inherited across fork belong to the parent
+    with _lock:
+        for series in _histograms.values():
+            series.clear()
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        if _dirty:
+            try:
+                flush()
+            except Exception as e:
+                print(f"Error writing metrics: {e}")
+
+_flusher = BackgroundThread(_flush_loop, "metrics-flusher", on_fork=_clear_inherited, at_exit=flush)
+
+
+# ---------------------------------------------- rendering -------------------------------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def gather():
+    """(merged histograms, gauges of live workers) from every worker file."""
+    histograms, gauges = {}, []
+    with _locked():
+        directory = settings.current.metrics_dir
+        _merge(histograms, (_read_json(os.path.join(directory, DEAD_NAME)) or {}))
+        for name in sorted(os.listdir(directory)):
+            match = re.fullmatch(r"worker-(\d+)\.json", name)
+            if not match:
+                continue
+            pid = int(match.group(1))
+            data = _read_json(os.path.join(directory, name))
+            if data is None:
+                continue
+            _merge(histograms, data.get("histograms", {}))
+            if not _alive(pid):
+                _fold_dead(pid, data)
+            else:
+                for gauge_name, help_text, labels, value in data.get("gauges", []):
+                    gauges.append((gauge_name, help_text, {**labels, "pid": str(pid)}, value))
+    return histograms, gauges
+
+def render() -> str:
+    histograms, gauges = gather()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, values in sorted(histograms.get(name, {}).items()):
+            pairs = [tuple(pair) for pair in json.loads(key)]
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{name}_sum{_format_labels(pairs)} {values[-2]}")
+            lines.append(f"{name}_count{_format_labels(pairs)} {values[-1]}")
+
+    described = set()
+    for name, help_text, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+        if name not in described:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            described.add(name)
+        lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,59 @@
+"""
+Versioned schema migrations.
+
+Each database module keeps an ordered list of (version, description, apply)
+tuples, where apply(conn) runs one schema change on the given connection.
+Applied versions are recorded in a schema_version table, so every migration
+runs exactly once per database file.
+"""
+
+import sqlite3
+from datetime import datetime
+
+def current_version(conn) -> int:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(pool, migrations) -> int | None:
+    """
+    Apply every pending migration in one transaction on the pool's writer.
+
+    BEGIN IMMEDIATE takes SQLite's write lock before the version is read, so
+    gunicorn workers starting together don't apply the same migration twice.
+    Migrations must not commit on their own (no executescript).
+
+    :param pool: db_pool.ConnectionPool
+    :param migrations: list of (version, description, apply) in ascending order
+    :return: schema version after migrating, or None if a migration failed
+    """
+    try:
+        with pool.write() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            version = current_version(conn)
+            for target, description, apply in migrations:
+                if target <= version:
+                    continue
+                apply(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (target, description, datetime.now().isoformat(timespec="seconds"))
+                )
+                print(f"{pool.db_path}: applied migration {target} ({description})")
+                version = target
+        return version
+    except sqlite3.Error as e:
+        print(f"Error migrating {pool.db_path}: {e}")
+        return None
+
+def migrate_schema(pool, migrations, name) -> int | None:
+    """migrate(), then print the version reached, as each database module does at import."""
+    version = migrate(pool, migrations)
+    if version is not None:
+        print(f"{name} schema is at version {version}.")
+    return version
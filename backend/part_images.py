@@ -0,0 +1,172 @@
+"""
+Resized / re-encoded variants of the part images, cached on disk.
+
+Variants are generated on first request (e.g. /part_images/3001.png?w=64),
+written to settings.image_cache_dir and reused until the source file changes.
+The cache is bounded by settings.image_cache_bytes; a cache hit bumps the
+file's mtime, and eviction removes the least recently used files first.
+
+Pillow is optional: without it only the original files are served.
+
+Usage: python part_images.py prewarm [--widths 64 128] [--formats webp png]
+"""
+
+import hashlib
+import os
+import threading
+
+from werkzeug.security import safe_join
+
+import settings
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+    print("Warning: Pillow not installed; part image variants are disabled.")
+
+# Widths are snapped up to one of these so arbitrary ?w= values can't fill the cache
+WIDTHS = (32, 64, 128, 256, 512)
+FORMATS = {"webp": "image/webp", "png": "image/png", "jpeg": "image/jpeg"}
+WEBP_QUALITY = 80
+# Evict down to this fraction of the cap, so eviction doesn't run on every write
+EVICT_TO = 0.9
+
+_lock = threading.Lock()
+_cache_bytes = None
+
+
+def snap_width(width) -> int | None:
+    """Round up to an allowed width; None keeps the original size."""
+    if width is None:
+        return None
+    for allowed in WIDTHS:
+        if width <= allowed:
+            return allowed
+    return WIDTHS[-1]
+
+def source_path(filename) -> str | None:
+    """Absolute path of an original image, or None if it is outside the image dir or missing."""
+    path = safe_join(settings.current.part_images_dir, filename)
+    return path if path and os.path.isfile(path) else None
+
+def variant_path(source, width, fmt) -> str:
+    # The source's mtime and size are part of the key, so a replaced image gets new variants
+    stat = os.stat(source)
+    key = f"{source}|{stat.st_mtime_ns}|{stat.st_size}|{width}|{fmt}"
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(os.path.abspath(settings.current.image_cache_dir), digest[:2], f"{digest}.{fmt}")
+
+def default_format(filename) -> str:
+    """Format to use when the client can't take WebP: keep JPEG as JPEG, everything else PNG."""
+    return "jpeg" if filename.lower().endswith((".jpg", ".jpeg")) else "png"
+
+def get_variant(filename, width=None, fmt="webp") -> str | None:
+    """
+    Path of a cached variant of filename at the given width (None for the
+    original size) and format, generating it if needed. Returns None if the
+    source doesn't exist.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    source = source_path(filename)
+    if source is None:
+        return None
+
+    width = snap_width(width)
+    path = variant_path(source, width, fmt)
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    with Image.open(source) as image:
+        if width and image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so concurrent requests never see a partial file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        options = {"quality": WEBP_QUALITY, "method": 4} if fmt == "webp" else {"optimize": True}
+        image.save(tmp, format=fmt.upper(), **options)
+    os.replace(tmp, path)
+    _account(path)
+    return path
+
+def _scan():
+    """(mtime, size, path) for every cached variant."""
+    entries = []
+    for root, _, files in os.walk(settings.current.image_cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+def _account(added_path):
+    """Add a new variant to the running cache size and evict if it went over the cap."""
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in _scan())
+        else:
+            _cache_bytes += os.path.getsize(added_path)
+        if _cache_bytes > settings.current.image_cache_bytes:
+            _cache_bytes = evict(int(settings.current.image_cache_bytes * EVICT_TO), keep=added_path)
+
+def evict(target_bytes, keep=None) -> int:
+    """
+    Delete least recently used variants until the cache is at most target_bytes
+    (never removing keep, the file about to be served); returns the new size.
+    """
+    entries = sorted(_scan())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= target_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+    return total
+
+def prewarm(widths=(64,), formats=("webp",)) -> int:
+    """Generate variants for every image in the part image directory; returns the number of files."""
+    count = 0
+    for root, _, files in os.walk(settings.current.part_images_dir):
+        for name in files:
+            filename = os.path.relpath(os.path.join(root, name), settings.current.part_images_dir)
+            for width in widths:
+                for fmt in formats:
+                    try:
+                        get_variant(filename, width, fmt)
+                        count += 1
+                    except (OSError, ValueError) as e:
+                        print(f"Skipping {filename}: {e}")
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Part image variant cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm = commands.add_parser("prewarm", help="generate variants for the whole catalog")
+    warm.add_argument("--widths", type=int, nargs="+", default=[64])
+    warm.add_argument("--formats", nargs="+", choices=sorted(FORMATS), default=["webp"])
+    args = parser.parse_args()
+
+    if args.command == "prewarm":
+        count = prewarm(args.widths, args.formats)
+        print(f"Pre-warmed {count} variants in {settings.current.image_cache_dir}.")
@@ -0,0 +1,228 @@
+"""
+Opt-in profiling of single requests.
+
+A request is profiled when it carries X-Profile: <PROFILE_TOKEN>, or when
+PROFILE_SAMPLE_RATE selects it. It then runs under cProfile, and the SQL
+statements it executes are captured from metrics.TimedCursor. Each profile
+is written to settings.profile_dir as <id>.prof (pstats format) and <id>.json
+(request details, SQL timings and the top functions). Only the newest
+PROFILE_MAX_FILES profiles are kept.
+
+Requests that aren't selected cost one header lookup and, with sampling on,
+one random() call. Streamed responses (format=ndjson, /finance/api/export) do
+their SQL work while the body is sent, so their profile runs until the
+response is closed.
+
+Usage:
+    python profiling.py list [--limit 20]
+    python profiling.py show <id> [--sort cumulative] [--limit 30]
+"""
+
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, jsonify, request
+
+import metrics
+import settings
+
+HEADER = "X-Profile"
+TOP_FUNCTIONS = 25
+
+
+def _authorized(value) -> bool:
+    token = settings.current.profile_token
+    return bool(token) and isinstance(value, str) and hmac.compare_digest(value.encode(), token.encode())
+
+def _selected():
+    """'header', 'sample' or None."""
+    value = request.headers.get(HEADER)
+    if value is not None and _authorized(value):
+        return "header"
+    rate = settings.current.profile_sample_rate
+    if rate > 0 and random.random() < rate:
+        return "sample"
+    return None
+
+
+# ---------------------------------------------- Flask hooks -------------------------------------------------
+
+def init_app(app):
+    app.before_request(_start)
+    app.after_request(_stop)
+    app.add_url_rule("/profiles", "list_profiles", list_view)
+    app.add_url_rule("/profiles/<profile_id>", "show_profile", show_view)
+
+def _start():
+    if request.endpoint in ("list_profiles", "show_profile"):
+        return
+    trigger = _selected()
+    if trigger is None:
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this thread
+        return
+    metrics.start_capture()
+    g.profile = (profiler, trigger, time.perf_counter())
+
+def _stop(response):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    profiler, trigger, start = profile
+    # The request context is gone by the time a streamed body has been sent
+    summary = {
+        "id": new_id(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "method": request.method,
+        "path": request.path,
+        "route": request.url_rule.rule if request.url_rule else None,
+        "status": response.status_code,
+        "trigger": trigger,
+        "streamed": response.is_streamed,
+    }
+
+    def finish():
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        try:
+            save(profiler, metrics.stop_capture(), elapsed, summary)
+        except OSError as e:
+            print(f"Error saving profile: {e}")
+
+    response.headers[f"{HEADER}-Id"] = summary["id"]
+    if response.is_streamed:
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+def list_view():
+    if not _authorized(request.headers.get(HEADER)):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(recent(request.args.get("limit", 20, type=int)))
+
+def show_view(profile_id):
+    if not _authorized(request.headers.get(HEADER)):
+        return jsonify({"error": "Unauthorized"}), 401
+    summary = load(profile_id)
+    if summary is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(summary)
+
+
+# ---------------------------------------------- storage -------------------------------------------------
+
+def _top_functions(profiler, limit=TOP_FUNCTIONS) -> list:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        "function": f"{os.path.basename(filename)}:{line}({name})",
+        "calls": calls,
+        "tottime_ms": round(tottime * 1000, 3),
+        "cumtime_ms": round(cumtime * 1000, 3),
+    } for (filename, line, name), (_, calls, tottime, cumtime, _) in rows]
+
+def new_id() -> str:
+    """Ids start with their timestamp, so they sort oldest first."""
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+def save(profiler, statements, elapsed, summary) -> str:
+    """
+    Write the .prof and .json files for one request; returns the profile id.
+
+    :param summary: id, time, method, path, route, status, trigger and streamed of the request
+    """
+    directory = settings.current.profile_dir
+    os.makedirs(directory, exist_ok=True)
+    profile_id = summary["id"]
+    summary = {
+        **summary,
+        "duration_ms": round(elapsed * 1000, 3),
+        "sql_ms": round(sum(seconds for _, _, seconds in statements) * 1000, 3),
+        "sql": [{"db": db, "statement": statement, "ms": round(seconds * 1000, 3)}
+                for db, statement, seconds in statements],
+        "top_functions": _top_functions(profiler),
+    }
+    profiler.dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+    with open(os.path.join(directory, f"{profile_id}.json"), "w") as f:
+        json.dump(summary, f)
+    prune(settings.current.profile_max_files)
+    return profile_id
+
+def _ids() -> list:
+    """Profile ids, oldest first (ids start with their timestamp)."""
+    directory = settings.current.profile_dir
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-5] for name in os.listdir(directory) if name.endswith(".json"))
+
+def prune(keep):
+    """Delete all but the newest keep profiles."""
+    ids = _ids()
+    for profile_id in ids[:max(0, len(ids) - keep)]:
+        for ext in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(settings.current.profile_dir, profile_id + ext))
+            except FileNotFoundError:
+                pass
+
+def load(profile_id) -> dict | None:
+    if not profile_id.replace("-", "").isalnum():
+        return None
+    try:
+        with open(os.path.join(settings.current.profile_dir, f"{profile_id}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def recent(limit=20) -> list:
+    """Newest first, without the per-statement and per-function detail."""
+    summaries = []
+    for profile_id in reversed(_ids()[-limit:] if limit > 0 else []):
+        summary = load(profile_id)
+        if summary is not None:
+            summaries.append({key: value for key, value in summary.items() if key not in ("sql", "top_functions")}
+                             | {"statements": len(summary.get("sql", []))})
+    return summaries
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Request profiles")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="recent profiles, newest first")
+    listing.add_argument("--limit", type=int, default=20)
+    show = commands.add_parser("show", help="SQL timings and pstats of one profile")
+    show.add_argument("id")
+    show.add_argument("--sort", default="cumulative")
+    show.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for p in recent(args.limit):
+            print(f"{p['id']}  {p['method']:<6} {p['path']:<40} {p['status']}  "
+                  f"{p['duration_ms']:>9.2f} ms  sql {p['sql_ms']:>8.2f} ms ({p['statements']})  {p['trigger']}")
+    elif args.command == "show":
+        summary = load(args.id)
+        if summary is None:
+            raise SystemExit(f"No profile {args.id} in {settings.current.profile_dir}")
+        print(f"{summary['method']} {summary['path']} -> {summary['status']} in {summary['duration_ms']} ms "
+              f"({summary['trigger']}, {summary['time']})")
+        print(f"\nSQL: {len(summary['sql'])} statements, {summary['sql_ms']} ms")
+        for s in sorted(summary["sql"], key=lambda s: s["ms"], reverse=True):
+            print(f"  {s['ms']:>9.3f} ms  {s['db']:<12} {s['statement'][:100]}")
+        print()
+        stats = pstats.Stats(os.path.join(settings.current.profile_dir, f"{args.id}.prof"))
+        stats.sort_stats(args.sort).print_stats(args.limit)
@@ -0,0 +1,116 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request
+
+
+def etag_for(body) -> str:
+    return hashlib.sha1(body).hexdigest()[:20]
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of rendered responses, keyed by path and query args.
+
+    Every lookup first reads version(), e.g. ConnectionPool.data_version, and
+    drops the whole cache when it has moved since the entries were stored.
+    Entries carry a strong ETag derived from the body, so the tag is the same
+    in every worker and If-None-Match is answered with 304.
+
+    :param version: zero-argument callable returning the current data version
+    :param max_entries: evict least recently used entries beyond this count
+    :param max_bytes: evict least recently used entries beyond this many body bytes
+    """
+
+    def __init__(self, version, max_entries=256, max_bytes=8 * 1024 * 1024):
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        version = self.version()
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key):
+        """Return (data version, entry or None)."""
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return self._version, entry
+
+    def set(self, key, body, mimetype, version):
+        """Store a body rendered at the given data version; dropped if the data has moved on since."""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version()
+            if version != self._version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (body, mimetype, etag_for(body))
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[0])
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def cached(self, view):
+        """Decorator for Flask views; only 200 responses are stored."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            version, entry = self.get(key)
+            if entry is not None:
+                body, mimetype, etag = entry
+                response = Response(body, mimetype=mimetype)
+                response.set_etag(etag)
+                return response.make_conditional(request)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                body = response.get_data()
+                self.set(key, body, response.mimetype, version)
+                response.set_etag(etag_for(body))
+                response = response.make_conditional(request)
+            return response
+        return wrapper
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
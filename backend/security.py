@@ -0,0 +1,355 @@
+"""
+Login throttling and lockouts, kept in memory in front of the security tables.
+
+check() answers from memory before any database work: banned IPs and locked
+accounts are cached with their end times, and every attempt takes a token
+from per-IP and per-username token buckets. Failed attempts are queued and
+written to failed_logins in batches by a background thread, which then locks
+accounts for LOCK_DURATION and bans IPs for BAN_DURATION once they go over
+their limit. Because the limits are evaluated against the table, attempts
+spread across gunicorn workers still count together. Expired rows are
+ignored when the cache is loaded and deleted by the next flush.
+
+Usernames are lowercased throughout, because finance looks transactions up
+COLLATE NOCASE: "KORY" is the same account as "kory" and shares its lock,
+bucket and failure count.
+
+Triggers on locked_accounts and banned_ips bump security_version, so any
+change - including an unlock or unban from data/security_management.py -
+makes every worker reload its cache within VERSION_CHECK_SECONDS.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import db_pool
+import migrations
+from background import BackgroundThread
+import settings
+import security_rollups
+
+# Failed attempts within FAILED_WINDOW that lock an account or ban an IP
+MAX_FAILED_PER_USER = 5
+MAX_FAILED_PER_IP = 20
+FAILED_WINDOW = timedelta(minutes=15)
+# How long automatic locks and bans last; rows with no end time stay until removed
+LOCK_DURATION = timedelta(minutes=15)
+BAN_DURATION = timedelta(hours=24)
+VERSION_CHECK_SECONDS = 2.0
+FLUSH_INTERVAL = 1.0
+# Flush early once this many attempts are queued
+MAX_PENDING = 500
+MAX_BUCKETS = 100000
+
+DB_FILE = settings.current.security_db
+os.makedirs(os.path.dirname(DB_FILE) or ".", exist_ok=True)
+
+
+def get_pool():
+    return db_pool.get_pool(DB_FILE, settings.current.pool_size)
+
+def _create_security_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS failed_logins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            ip_address TEXT,
+            attempt_time TIMESTAMP NOT NULL
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(failed_logins)")}
+    if "ip_address" not in columns:
+        conn.execute("ALTER TABLE failed_logins ADD COLUMN ip_address TEXT")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS locked_accounts (
+            username TEXT PRIMARY KEY,
+            locked_at TIMESTAMP NOT NULL,
+            failed_attempts INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS banned_ips (
+            ip_address TEXT PRIMARY KEY,
+            banned_at TIMESTAMP NOT NULL,
+            reason TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_failed_logins_user_time ON failed_logins (username, attempt_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_failed_logins_ip_time ON failed_logins (ip_address, attempt_time)")
+
+def _create_security_version(conn):
+    """Single-row counter bumped on every change to the lock and ban tables."""
+    conn.execute("CREATE TABLE IF NOT EXISTS security_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO security_version (id, version) VALUES (1, 0)")
+    for table in ("locked_accounts", "banned_ips"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE security_version SET version = version + 1 WHERE id = 1;
+                END
+            """)
+
+def _lowercase_usernames(conn):
+    """Merge rows stored under other casings of a username into the lowercase one."""
+    conn.execute("UPDATE failed_logins SET username = lower(username) WHERE username != lower(username)")
+    conn.execute("""
+        INSERT OR IGNORE INTO locked_accounts (username, locked_at, failed_attempts)
+        SELECT lower(username), MIN(locked_at), MAX(failed_attempts) FROM locked_accounts
+        WHERE username != lower(username) GROUP BY lower(username)
+    """)
+    conn.execute("DELETE FROM locked_accounts WHERE username != lower(username)")
+    conn.execute("""
+        INSERT INTO failed_logins_by_user_hour (hour, username, attempts)
+        SELECT hour, lower(username), SUM(attempts) FROM failed_logins_by_user_hour
+        WHERE username != lower(username) GROUP BY hour, lower(username)
+        ON CONFLICT (hour, username) DO UPDATE SET attempts = attempts + excluded.attempts
+    """)
+    conn.execute("DELETE FROM failed_logins_by_user_hour WHERE username != lower(username)")
+
+def _add_expiry(conn):
+    """Automatic locks and bans end at locked_until / banned_until; existing rows get the default duration."""
+    for table, column, started, duration in (("locked_accounts", "locked_until", "locked_at", LOCK_DURATION),
+                                             ("banned_ips", "banned_until", "banned_at", BAN_DURATION)):
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TIMESTAMP")
+        seconds = f"+{int(duration.total_seconds())} seconds"
+        conn.execute(f"""
+            UPDATE {table} SET {column} = COALESCE(datetime({started}, ?), datetime('now', 'localtime', ?))
+            WHERE {column} IS NULL
+        """, (seconds, seconds))
+
+MIGRATIONS = [
+    (1, "failed login, locked account and banned IP tables", _create_security_tables),
+    (2, "security version stamp", _create_security_version),
+    (3, "hourly failed login rollups and lock/ban counts", security_rollups.create_rollups),
+    (4, "lowercase usernames", _lowercase_usernames),
+    (5, "expiry times for locks and bans", _add_expiry),
+]
+
+def migrate():
+    """Bring the security database up to the latest schema version."""
+    return migrations.migrate_schema(get_pool(), MIGRATIONS, "Security")
+
+migrate()
+
+
+def normalize_username(username):
+    return username.lower() if isinstance(username, str) else username
+
+def _now() -> str:
+    """Local time in the format locked_until and banned_until are stored in."""
+    return datetime.now().isoformat(sep=" ")
+
+def _active(entries, key, current) -> bool:
+    """Whether key has a lock or ban in entries that hasn't ended by current."""
+    if key not in entries:
+        return False
+    until = entries[key]
+    return until is None or until > current
+
+
+class TokenBucket:
+    """Login attempts per IP or username: login_burst at once, refilling at login_rate_per_minute."""
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, now):
+        self.tokens = float(settings.current.login_burst)
+        self.updated = now
+
+    def take(self, now) -> bool:
+        rate = settings.current.login_rate_per_minute / 60
+        self.tokens = min(settings.current.login_burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class LoginGuard:
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        # ip / username -> end time ("YYYY-MM-DD HH:MM:SS[.ffffff]") or None
+        self._banned = {}
+        self._locked = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._pending = []
+        self._cleared = set()
+        self._wake = threading.Event()
+        self._flusher = BackgroundThread(self._run, "login-guard-flusher", on_fork=self._reset, at_exit=self.flush)
+        self.allowed = 0
+        self.rejected = {"banned": 0, "locked": 0, "rate_limited": 0}
+        self.flushes = 0
+
+    def refresh(self, force=False):
+        """
+        Reload the active bans and locks if security_version has moved; at most
+        every VERSION_CHECK_SECONDS. Expiry is checked again in check(), so a
+        lock ends on time without a reload.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < VERSION_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        with self.pool.read() as conn:
+            version = conn.execute("SELECT version FROM security_version WHERE id = 1").fetchone()[0]
+            if version == self._version and not force:
+                return
+            current = _now()
+            banned = dict(conn.execute(
+                "SELECT ip_address, banned_until FROM banned_ips WHERE banned_until IS NULL OR banned_until > ?", (current,)
+            ).fetchall())
+            locked = {normalize_username(username): until for username, until in conn.execute(
+                "SELECT username, locked_until FROM locked_accounts WHERE locked_until IS NULL OR locked_until > ?", (current,)
+            )}
+        with self._lock:
+            self._banned, self._locked, self._version = banned, locked, version
+
+    def _take(self, key, now) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(now)
+            if len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(now)
+
+    def check(self, username, ip) -> str | None:
+        """
+        Decide whether a login attempt may go ahead, without touching the
+        database unless the version check is due.
+
+        :return: None if allowed, else "banned", "locked" or "rate_limited"
+        """
+        username = normalize_username(username)
+        try:
+            self.refresh()
+        except Exception as e:
+            # Keep serving from the cached sets if the database is unavailable
+            print(f"Error refreshing security cache: {e}")
+        now = time.monotonic()
+        current = _now()
+        with self._lock:
+            if _active(self._banned, ip, current):
+                reason = "banned"
+            elif _active(self._locked, username, current):
+                reason = "locked"
+            else:
+                # Both buckets pay for the attempt, even when one of them is already empty
+                ip_ok = self._take(("ip", ip), now)
+                user_ok = self._take(("user", username), now)
+                reason = None if ip_ok and user_ok else "rate_limited"
+            if reason is None:
+                self.allowed += 1
+                return None
+            self.rejected[reason] += 1
+            return reason
+
+    def record_failure(self, username, ip):
+        """Queue a failed attempt; written with the next batch."""
+        username = normalize_username(username)
+        # Before queueing: in a freshly forked worker this drops the parent's queue
+        self._flusher.ensure()
+        with self._lock:
+            self._pending.append((username, ip, datetime.now().isoformat(sep=" ")))
+            full = len(self._pending) >= MAX_PENDING
+        if full:
+            self._wake.set()
+
+    def record_success(self, username):
+        """Forget the account's failed attempts, as a successful login resets the count."""
+        username = normalize_username(username)
+        self._flusher.ensure()
+        with self._lock:
+            self._cleared.add(username)
+
+    def _reset(self):
+        # Attempts queued before a fork are the parent's to write
+        with self._lock:
+            self._pending, self._cleared = [], set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing failed logins: {e}")
+
+    def flush(self):
+        """
+        Write queued attempts in one transaction, then lock accounts and ban
+        IPs whose failures in FAILED_WINDOW (across all workers) reached the limit.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            cleared, self._cleared = self._cleared, set()
+        if not pending and not cleared:
+            return
+
+        started = datetime.now()
+        since = (started - FAILED_WINDOW).isoformat(sep=" ")
+        now = started.isoformat(sep=" ")
+        with self.pool.write() as conn:
+            # Expired rows would otherwise stop a new lock or ban below
+            conn.execute("DELETE FROM locked_accounts WHERE locked_until <= ?", (now,))
+            conn.execute("DELETE FROM banned_ips WHERE banned_until <= ?", (now,))
+            conn.executemany("DELETE FROM failed_logins WHERE username = ?", [(u,) for u in cleared])
+            conn.executemany("INSERT INTO failed_logins (username, ip_address, attempt_time) VALUES (?, ?, ?)", pending)
+            for username in {u for u, _, _ in pending if u and u not in cleared}:
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM failed_logins WHERE username = ? AND attempt_time > ?", (username, since)
+                ).fetchone()[0]
+                if count >= MAX_FAILED_PER_USER:
+                    conn.execute("""
+                        INSERT INTO locked_accounts (username, locked_at, locked_until, failed_attempts)
+                        SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM locked_accounts WHERE username = ?)
+                    """, (username, now, (started + LOCK_DURATION).isoformat(sep=" "), count, username))
+            for ip in {ip for _, ip, _ in pending if ip}:
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM failed_logins WHERE ip_address = ? AND attempt_time > ?", (ip, since)
+                ).fetchone()[0]
+                if count >= MAX_FAILED_PER_IP:
+                    conn.execute("""
+                        INSERT INTO banned_ips (ip_address, banned_at, banned_until, reason)
+                        SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM banned_ips WHERE ip_address = ?)
+                    """, (ip, now, (started + BAN_DURATION).isoformat(sep=" "),
+                          f"{count} failed logins in {FAILED_WINDOW}", ip))
+        self.flushes += 1
+        # New locks and bans bumped the version; pick them up now rather than at the next check
+        self.refresh(force=True)
+
+    def stats(self) -> dict:
+        current = _now()
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                **{f"rejected_{reason}": count for reason, count in self.rejected.items()},
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+                "buckets": len(self._buckets),
+                "banned_ips": sum(_active(self._banned, ip, current) for ip in self._banned),
+                "locked_accounts": sum(_active(self._locked, user, current) for user in self._locked),
+                "version": self._version,
+            }
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+def get_guard() -> LoginGuard:
+    """The process's guard; a forked worker keeps the cached sets and restarts the flusher on first use."""
+    global _guard
+    with _guard_lock:
+        if _guard is None:
+            _guard = LoginGuard(get_pool())
+        return _guard
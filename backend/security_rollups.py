@@ -0,0 +1,90 @@
+"""
+Hourly rollups of failed logins, for stats that don't scan failed_logins.
+
+Triggers on failed_logins add every attempt to failed_logins_by_ip_hour and
+failed_logins_by_user_hour, and triggers on locked_accounts and banned_ips
+keep their row counts in security_counts. A windowed query then reads at
+most one row per hour and key. The rollups record attempts as they
+happened: clearing failed_logins on unlock doesn't remove them.
+
+No import-time side effects, so data/security_management.py can use it on
+its own connection.
+"""
+
+from datetime import datetime, timedelta
+
+HOUR_FORMAT = "%Y-%m-%d %H:00"
+
+
+def create_rollups(conn):
+    """Migration: rollup tables, their triggers, and a backfill from existing rows."""
+    for key in ("ip_address", "username"):
+        table = "failed_logins_by_ip_hour" if key == "ip_address" else "failed_logins_by_user_hour"
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                hour TEXT NOT NULL,
+                {key} TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                PRIMARY KEY (hour, {key})
+            ) WITHOUT ROWID
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON failed_logins
+            WHEN strftime('{HOUR_FORMAT}', new.attempt_time) IS NOT NULL BEGIN
+                INSERT INTO {table} (hour, {key}, attempts)
+                VALUES (strftime('{HOUR_FORMAT}', new.attempt_time), COALESCE(new.{key}, ''), 1)
+                ON CONFLICT (hour, {key}) DO UPDATE SET attempts = attempts + 1;
+            END
+        """)
+        conn.execute(f"""
+            INSERT INTO {table} (hour, {key}, attempts)
+            SELECT strftime('{HOUR_FORMAT}', attempt_time), COALESCE({key}, ''), COUNT(*)
+            FROM failed_logins
+            WHERE strftime('{HOUR_FORMAT}', attempt_time) IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (hour, {key}) DO UPDATE SET attempts = excluded.attempts
+        """)
+
+    conn.execute("CREATE TABLE IF NOT EXISTS security_counts (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    for table in ("locked_accounts", "banned_ips"):
+        conn.execute(f"""
+            INSERT INTO security_counts (name, value) SELECT '{table}', COUNT(*) FROM {table} WHERE true
+            ON CONFLICT (name) DO UPDATE SET value = excluded.value
+        """)
+        for event, delta in (("INSERT", "+ 1"), ("DELETE", "- 1")):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_count_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE security_counts SET value = value {delta} WHERE name = '{table}';
+                END
+            """)
+
+
+def window_stats(conn, hours=24, top=10) -> dict:
+    """
+    Failed attempts in the last hours (whole hours, counting the current
+    one), the top offending IPs and usernames, and current lock/ban counts.
+    """
+    since = (datetime.now() - timedelta(hours=max(hours, 1) - 1)).strftime(HOUR_FORMAT)
+    hourly = conn.execute("""
+        SELECT hour, SUM(attempts) FROM failed_logins_by_ip_hour
+        WHERE hour >= ? GROUP BY hour ORDER BY hour
+    """, (since,)).fetchall()
+    top_ips = conn.execute("""
+        SELECT ip_address, SUM(attempts) AS attempts FROM failed_logins_by_ip_hour
+        WHERE hour >= ? AND ip_address != '' GROUP BY ip_address ORDER BY attempts DESC, ip_address LIMIT ?
+    """, (since, top)).fetchall()
+    top_users = conn.execute("""
+        SELECT username, SUM(attempts) AS attempts FROM failed_logins_by_user_hour
+        WHERE hour >= ? AND username != '' GROUP BY username ORDER BY attempts DESC, username LIMIT ?
+    """, (since, top)).fetchall()
+    counts = dict(conn.execute("SELECT name, value FROM security_counts").fetchall())
+    return {
+        "hours": hours,
+        "since": since,
+        "failed_attempts": sum(count for _, count in hourly),
+        "hourly": [{"hour": hour, "attempts": count} for hour, count in hourly],
+        "top_ips": [{"ip_address": ip, "attempts": count} for ip, count in top_ips],
+        "top_usernames": [{"username": username, "attempts": count} for username, count in top_users],
+        "locked_accounts": counts.get("locked_accounts", 0),
+        "banned_ips": counts.get("banned_ips", 0),
+    }
@@ -0,0 +1,137 @@
+"""
+Backend settings, read once from the environment (and .env) at import.
+
+Secrets are reloaded on SIGHUP so credentials can be rotated without a
+restart; database paths and pool/cache sizes are fixed at import and need a
+restart to change.
+"""
+
+import hmac
+import ipaddress
+import os
+import signal
+import threading
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+
+@dataclass(frozen=True)
+class Settings:
+    finance_api_pw: str | None
+    finance_db: str
+    lego_db: str
+    pool_size: int
+    lego_cache_entries: int
+    lego_cache_bytes: int
+    finance_write_queue: bool
+    part_images_dir: str
+    image_cache_dir: str
+    image_cache_bytes: int
+    compression_min_bytes: int
+    compression_cache_bytes: int
+    call_log_dir: str
+    call_log_max_bytes: int
+    call_log_rotate_seconds: int
+    metrics_dir: str
+    metrics_token: str | None
+    profile_dir: str
+    profile_token: str | None
+    profile_sample_rate: float
+    profile_max_files: int
+    security_db: str
+    login_rate_per_minute: float
+    login_burst: int
+    trusted_proxies: tuple
+    events_db: str
+    logins_log: str
+    calls_log: str
+
+
+def parse_networks(value) -> tuple:
+    """Comma-separated addresses or CIDR ranges as ip_network objects."""
+    return tuple(ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip())
+
+
+def load(override=False) -> Settings:
+    """
+    Read settings from the environment and .env.
+
+    :param override: let .env values replace variables already in the
+        environment. At startup the process environment wins, as it always
+        has; reload() overrides, because by then os.environ holds the values
+        .env supplied at startup and a rotated secret must replace them.
+    """
+    load_dotenv(override=override)
+    return Settings(
+        finance_api_pw=os.environ.get("FINANCE_API_PW"),
+        finance_db=os.environ.get("FINANCE_DB_PATH", os.path.join("data", "finance.db")),
+        lego_db=os.environ.get("LEGO_DB_PATH", os.path.join("data", "lego_db.db")),
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 4)),
+        lego_cache_entries=int(os.environ.get("LEGO_CACHE_ENTRIES", 512)),
+        lego_cache_bytes=int(os.environ.get("LEGO_CACHE_BYTES", 16 * 1024 * 1024)),
+        finance_write_queue=os.environ.get("FINANCE_WRITE_QUEUE", "0") == "1",
+        part_images_dir=os.environ.get("PART_IMAGES_DIR", "/app/public/part_images"),
+        image_cache_dir=os.environ.get("IMAGE_CACHE_DIR", os.path.join("data", "image_cache")),
+        image_cache_bytes=int(os.environ.get("IMAGE_CACHE_BYTES", 256 * 1024 * 1024)),
+        compression_min_bytes=int(os.environ.get("COMPRESSION_MIN_BYTES", 1024)),
+        compression_cache_bytes=int(os.environ.get("COMPRESSION_CACHE_BYTES", 32 * 1024 * 1024)),
+        call_log_dir=os.environ.get("CALL_LOG_DIR", os.path.join("data", "calls")),
+        call_log_max_bytes=int(os.environ.get("CALL_LOG_MAX_BYTES", 16 * 1024 * 1024)),
+        call_log_rotate_seconds=int(os.environ.get("CALL_LOG_ROTATE_SECONDS", 24 * 3600)),
+        metrics_dir=os.environ.get("METRICS_DIR", os.path.join("data", "metrics")),
+        metrics_token=os.environ.get("METRICS_TOKEN"),
+        profile_dir=os.environ.get("PROFILE_DIR", os.path.join("data", "profiles")),
+        profile_token=os.environ.get("PROFILE_TOKEN"),
+        profile_sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+        profile_max_files=int(os.environ.get("PROFILE_MAX_FILES", 200)),
+        security_db=os.environ.get("PRIVATE_DB_PATH", os.path.join("data", "private_finance.db")),
+        login_rate_per_minute=float(os.environ.get("LOGIN_RATE_PER_MINUTE", 10)),
+        login_burst=int(os.environ.get("LOGIN_BURST", 10)),
+        trusted_proxies=parse_networks(os.environ.get("TRUSTED_PROXIES", "127.0.0.1/32,::1/128")),
+        events_db=os.environ.get("EVENTS_DB_PATH", os.path.join("data", "events.db")),
+        logins_log=os.environ.get("LOGINS_LOG_PATH", os.path.join("data", "logins.txt")),
+        calls_log=os.environ.get("CALLS_LOG_PATH", os.path.join("data", "calls.txt")),
+    )
+
+
+# Fields re-read by reload()
+SECRETS = ("finance_api_pw", "metrics_token", "profile_token")
+
+current = load()
+_lock = threading.Lock()
+
+
+def reload() -> Settings:
+    """Re-read secrets; everything else keeps its startup value."""
+    global current
+    fresh = load(override=True)
+    with _lock:
+        current = Settings(**{**current.__dict__, **{name: getattr(fresh, name) for name in SECRETS}})
+    print("Settings reloaded.")
+    return current
+
+
+def check_finance_password(candidate) -> bool:
+    """Constant-time compare against the cached FINANCE_API_PW; never matches when it is unset."""
+    expected = current.finance_api_pw
+    if not expected or not isinstance(candidate, str):
+        return False
+    return hmac.compare_digest(candidate.encode(), expected.encode())
+
+
+def check_metrics_token(authorization) -> bool:
+    """Constant-time check of an Authorization header against the METRICS_TOKEN bearer; never matches when it is unset."""
+    token = current.metrics_token
+    if not token or not isinstance(authorization, str):
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+def install_reload_handler():
+    """Reload secrets on SIGHUP. Only possible from the main thread, which is where gunicorn loads the app."""
+    try:
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload())
+    except (ValueError, AttributeError):
+        # Not the main thread, or no SIGHUP on this platform
+        pass
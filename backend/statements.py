@@ -0,0 +1,176 @@
+"""
+Bank-statement CSV import with deduplication.
+
+The CSV is read one row at a time and its columns are mapped onto the
+insert_transaction fields, either from an explicit mapping or by matching
+common header names (Date, Posting Date, Amount, Description, Payee, ...).
+Every row gets a content hash of user, date, amount, title and description,
+plus how many identical rows came before it in the same file, so two equal
+purchases on one statement are both kept. The hashes are checked against the
+unique idx_transactions_content_hash index: a row that is already stored is
+counted as a duplicate, which makes re-importing overlapping statements safe.
+
+Rows are inserted CHUNK_ROWS at a time, one database transaction per chunk.
+
+Usage:
+    python statements.py <user> statement.csv [--map date="Posting Date"] [--date-format %m/%d/%Y]
+"""
+
+import csv
+import hashlib
+import io
+import math
+from collections import Counter
+from datetime import datetime
+
+import finance
+
+CHUNK_ROWS = 1000
+# Rejected rows reported back; the rest are only counted
+MAX_ERRORS = 100
+DEFAULT_CATEGORY = "Uncategorized"
+
+FIELDS = ("date", "amount", "title", "description", "category")
+# Header names tried, in order, for each field when no mapping is given
+HEADER_ALIASES = {
+    "date": ["date", "transaction date", "posting date", "posted date", "trans. date"],
+    "amount": ["amount", "transaction amount", "amount (usd)"],
+    "title": ["title", "description", "payee", "name", "merchant"],
+    "description": ["memo", "details", "notes", "extended details"],
+    "category": ["category", "type"],
+}
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d %H:%M:%S", "%b %d, %Y at %I:%M %p", "%d %b %Y"]
+
+
+def resolve_columns(header, mapping=None) -> dict:
+    """
+    Field -> CSV column. Explicit mapping entries win; other fields are
+    matched case-insensitively against HEADER_ALIASES.
+
+    :raises ValueError: if date, amount or title has no column
+    """
+    mapping = dict(mapping or {})
+    unknown = set(mapping) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields in mapping: {', '.join(sorted(unknown))}")
+    by_name = {name.strip().lower(): name for name in header}
+    used = set(mapping.values())
+    for field in FIELDS:
+        if field in mapping:
+            if mapping[field] not in header:
+                raise ValueError(f"Column '{mapping[field]}' for {field} is not in the CSV header")
+            continue
+        for alias in HEADER_ALIASES[field]:
+            name = by_name.get(alias)
+            if name is not None and name not in used:
+                mapping[field] = name
+                used.add(name)
+                break
+    missing = [field for field in ("date", "amount", "title") if field not in mapping]
+    if missing:
+        raise ValueError(f"No column for {', '.join(missing)}; pass a mapping")
+    return mapping
+
+def parse_date(value, date_format=None) -> datetime:
+    value = value.strip()
+    for fmt in [date_format] if date_format else DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date '{value}'")
+
+def parse_amount(value) -> float:
+    """'1,234.50', '$12.00' and '(12.00)' (negative) as floats."""
+    text = value.strip().replace(",", "").replace("$", "")
+    negative = text.startswith("(") and text.endswith(")")
+    if negative:
+        text = text[1:-1]
+    try:
+        amount = float(text)
+    except ValueError:
+        amount = math.nan
+    if not math.isfinite(amount):
+        raise ValueError(f"Invalid amount '{value}'")
+    return -amount if negative else amount
+
+def content_hash(user, date_obj, amount, title, description, occurrence) -> str:
+    key = "\x1f".join([user.lower(), date_obj.strftime("%Y-%m-%d %H:%M:%S"), f"{amount:.2f}",
+                       title, description or "", str(occurrence)])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def import_csv(user, lines, mapping=None, date_format=None, default_category=DEFAULT_CATEGORY, logger=None) -> dict:
+    """
+    Import a statement for user.
+
+    :param lines: iterable of CSV text lines, e.g. an open file or io.TextIOWrapper over a request stream
+    :param mapping: {field: column} for any of FIELDS
+    :param date_format: strptime format; by default DATE_FORMATS are tried in turn
+    :return: {"inserted", "duplicates", "rejected", "errors"}; errors lists the first MAX_ERRORS rejected rows
+    :raises ValueError: if the header can't be mapped
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames:
+        raise ValueError("CSV is empty")
+    columns = resolve_columns(reader.fieldnames, mapping)
+    seen = Counter()
+    result = {"inserted": 0, "duplicates": 0, "rejected": 0, "errors": []}
+    chunk = []
+
+    def flush():
+        counts = finance.insert_unique_transactions(chunk, logger=logger)
+        if counts is None:
+            raise RuntimeError(f"Import stopped after {result['inserted']} rows: database error")
+        result["inserted"] += counts[0]
+        result["duplicates"] += counts[1]
+        chunk.clear()
+
+    for row in reader:
+        try:
+            date_obj = parse_date(row[columns["date"]] or "", date_format)
+            amount = parse_amount(row[columns["amount"]] or "")
+            title = (row[columns["title"]] or "").strip()
+            if not title:
+                raise ValueError("Missing title")
+            description = (row[columns["description"]] or "").strip() if "description" in columns else ""
+            category = ((row[columns["category"]] or "").strip() if "category" in columns else "") or default_category
+        except (ValueError, TypeError) as e:
+            result["rejected"] += 1
+            if len(result["errors"]) < MAX_ERRORS:
+                result["errors"].append({"line": reader.line_num, "error": str(e)})
+            continue
+        key = (date_obj, round(amount, 2), title, description)
+        occurrence = seen[key]
+        seen[key] += 1
+        chunk.append({
+            "user": user, "category": category, "amount": amount, "date_obj": date_obj, "title": title,
+            "description": description, "rate": None,
+            "content_hash": content_hash(user, date_obj, amount, title, description, occurrence),
+        })
+        if len(chunk) >= CHUNK_ROWS:
+            flush()
+    if chunk:
+        flush()
+    return result
+
+def import_stream(user, stream, encoding="utf-8-sig", **options) -> dict:
+    """import_csv() over a binary stream such as request.stream or an uploaded file."""
+    return import_csv(user, io.TextIOWrapper(stream, encoding=encoding, errors="replace", newline=""), **options)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Import a bank statement CSV")
+    parser.add_argument("user")
+    parser.add_argument("path")
+    parser.add_argument("--map", action="append", default=[], metavar="FIELD=COLUMN",
+                        help=f"CSV column for one of {', '.join(FIELDS)}; repeatable")
+    parser.add_argument("--date-format")
+    parser.add_argument("--category", default=DEFAULT_CATEGORY, help="for rows without a category")
+    args = parser.parse_args()
+
+    mapping = dict(item.split("=", 1) for item in args.map)
+    with open(args.path, encoding="utf-8-sig", newline="") as f:
+        print(json.dumps(import_csv(args.user, f, mapping, args.date_format, args.category), indent=2))
@@ -0,0 +1,161 @@
+"""
+Group-commit writer for a SQLite connection pool.
+
+Writes are queued as callables op(conn) and drained by a single thread that
+runs them in small batches - up to max_batch operations, or whatever arrives
+within max_delay_ms of the first - inside one transaction. Each operation gets
+its own savepoint, so a failing one is rolled back alone, and every caller's
+future is resolved only after the batch has committed. An operation whose
+future was cancelled before its batch started (a caller that gave up) is
+skipped.
+"""
+
+import queue
+import time
+from concurrent.futures import Future
+
+from background import BackgroundThread
+
+MAX_BATCH = 64
+MAX_DELAY_MS = 5
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    :param pool: db_pool.ConnectionPool whose serialized writer runs the batches
+    :param max_batch: most operations committed together
+    :param max_delay_ms: longest wait for more operations after the first arrives
+    """
+
+    def __init__(self, pool, max_batch=MAX_BATCH, max_delay_ms=MAX_DELAY_MS):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = BackgroundThread(self._run, "group-commit-writer", on_fork=self._reset, at_exit=self.stop)
+        self.batches = 0
+        self.operations = 0
+        self.failed = 0
+        self.max_batch_seen = 0
+        self.last_batch_size = 0
+        self.max_queue_depth = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread.running
+
+    def start(self):
+        self._thread.ensure()
+
+    def _reset(self):
+        # Operations queued before a fork are the parent's to commit
+        self._queue = queue.Queue()
+
+    def stop(self, timeout=5):
+        """Drain queued operations and stop the writer thread."""
+        if self.running:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def submit(self, op) -> Future:
+        """Queue op(conn); the future resolves to its return value once committed."""
+        if not self.running:
+            self.start()
+        future = Future()
+        self._queue.put((op, future))
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return future
+
+    def _collect(self):
+        """Block for the first operation, then gather more until the batch is full or the delay passes."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self._commit(batch)
+            if stopping:
+                # Anything queued behind the stop marker still gets written
+                leftovers = []
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not _STOP:
+                        leftovers.append(item)
+                if leftovers:
+                    self._commit(leftovers)
+                return
+
+    def _commit(self, batch):
+        batch = [(op, future) for op, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            with self.pool.write() as conn:
+                conn.execute("BEGIN")
+                for op, future in batch:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        result = op(conn)
+                        conn.execute("RELEASE op")
+                        results.append((future, result, None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO op")
+                        conn.execute("RELEASE op")
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed: nothing in this batch is durable
+            for _, future in batch:
+                future.set_exception(e)
+            self.failed += len(batch)
+            return
+
+        for future, result, error in results:
+            if error is not None:
+                self.failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        self.batches += 1
+        self.operations += len(batch)
+        self.last_batch_size = len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "operations": self.operations,
+            "failed": self.failed,
+            "mean_batch_size": round(self.operations / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "last_batch_size": self.last_batch_size,
+        }
+
+
+def create(pool, **kwargs) -> GroupCommitWriter:
+    """Build a writer; it is drained and stopped at interpreter exit."""
+    return GroupCommitWriter(pool, **kwargs)